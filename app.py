@@ -3,12 +3,20 @@ import os
 import json
 import yaml
 import atexit
+import can
 import paho.mqtt.client as mqtt
 from uxr_charger_module import UXRChargerModule
+from scheduler import HeartbeatScheduler, PollScheduler, WriteQueue
+from telemetry import AGGREGATES, ChangeFilter, Rollups, Snapshot, aggregate
+from history import HistoryStore
+from metrics import MetricsServer
+from registers import RATED_CURRENT, REGISTERS, REGISTERS_BY_NAME, POLLED_REGISTERS, SENSOR_REGISTERS, COMMAND_REGISTERS, from_raw, in_range
 import threading
 import logging
 import sys
+import math
 import traceback
+from functools import partial
 
 # Configure logging
 logging.basicConfig(
@@ -44,29 +52,263 @@ UXR_MODULES = config['modules']
 DEFAULT_CURRENT = config['default_current_limit']
 DEFAULT_VOLTAGE = config['default_voltage']
 PORT = config['port']
+CAN_INTERFACE = config.get('can_interface', 'slcan')
+CAN_BITRATE = config.get('can_bitrate', 125000)
+CAN_PROTOCOL_FILTER = config.get('can_protocol_filter', True)
 
-# Initialize the UXRChargerModule
-module = UXRChargerModule(channel=PORT)
+
+def parse_can_options(options):
+    """Parses python-can driver options given as "name=value" strings, values as YAML scalars."""
+    parsed = {}
+    for option in options:
+        name, _, value = option.partition('=')
+        parsed[name.strip()] = yaml.safe_load(value)
+    return parsed
+
+
+# Extra python-can driver options for the default bus, and for buses without their own OPTIONS
+CAN_OPTIONS = parse_can_options(config.get('can_options', []))
+HEARTBEAT_INTERVAL = config.get('heartbeat_interval', 1.0)
+# Modules still silent after discovery_timeout are reported offline but keep being probed
+DISCOVERY_TIMEOUT = config.get('discovery_timeout', 60)
+# Backoff between probe rounds, doubling from the first to the last
+DISCOVERY_MIN_DELAY = 0.5
+DISCOVERY_MAX_DELAY = 30
+# Seconds to wait for probe replies, live modules answer within milliseconds
+PROBE_TIMEOUT = 0.5
+# Seconds a poll pass waits for replies beyond the time its frames take on the bus,
+# so one silent module costs each pass this much rather than a fixed 2 s
+POLL_TIMEOUT = 0.5
+# Modules that answer nothing for this many poll passes in a row leave the timetable and go back to discovery
+POLL_MAX_MISSES = 3
+# Sweep every bus for modules and add them to the modules option
+SCAN_MODULES = config.get('scan_modules', False)
+# Read set-points back after writing them and publish what the module reports
+WRITE_READBACK = config.get('write_readback', False)
+# Publish state only when it changes by more than its deadband, or has not been published for max age
+PUBLISH_ON_CHANGE = config.get('publish_on_change', True)
+PUBLISH_MAX_AGE = config.get('publish_max_age', 300)
+# Publish min/mean/max of each reading over these windows in seconds instead of the readings themselves
+ROLLUP_WINDOWS = sorted(config.get('rollup_windows', []))
+# Publish each module's readings as one JSON document on <base>/<serial>/state instead of a topic each,
+# unless rollups replace publishing readings altogether
+STATE_JSON = config.get('state_json', False) and not ROLLUP_WINDOWS
+# Publish totals and extremes per group under <base>/group/<group>/ and per bus under <base>/rack/<bus>/
+PUBLISH_AGGREGATES = config.get('publish_aggregates', True)
+# Keep every reading in memory-mapped ring buffers of history_capacity samples per module and register
+HISTORY_ENABLED = config.get('history', False)
+HISTORY_CAPACITY = config.get('history_capacity', 86400)
+HISTORY_DIRECTORY = '/data/history'
+# Serve Prometheus metrics from the latest readings on http://<host>:9102/metrics
+METRICS_ENABLED = config.get('metrics', False)
+METRICS_PORT = 9102
+# Modules found by the last sweep, reused on restart while the bus port is unchanged, every cached module
+# answers and no module was configured since; a module the next sweep misses is dropped from it
+SCAN_CACHE_FILE = '/data/uxr_modules.json'
+# Static module data by serial number, so discovery needs only the serial read on restart
+METADATA_CACHE_FILE = '/data/uxr_metadata.json'
+METADATA_REGISTERS = ['rated_output_power', 'rated_output_current', 'dcdc_version', 'pfc_version']
+# Seconds to wait for power stability before switching on chargers
+POWER_ON_DELAY = 5
+# Tries at the switch-on broadcast per group, a second apart
+TURN_ON_ATTEMPTS = 5
+
+# CAN adapters by name; port/can_interface/can_bitrate/can_protocol_filter/can_options describe
+# the default one and the buses option adds more, which modules select with their optional BUS key
+DEFAULT_BUS = "default"
+BUS_CONFIGS = {DEFAULT_BUS: {"PORT": PORT, "INTERFACE": CAN_INTERFACE, "BITRATE": CAN_BITRATE,
+                             "PROTOCOL_FILTER": CAN_PROTOCOL_FILTER, "OPTIONS": CAN_OPTIONS}}
+for bus_config in config.get('buses', []):
+    BUS_CONFIGS[bus_config['NAME']] = {
+        "PORT": bus_config['PORT'],
+        "INTERFACE": bus_config.get('INTERFACE', CAN_INTERFACE),
+        "BITRATE": bus_config.get('BITRATE', CAN_BITRATE),
+        "PROTOCOL_FILTER": bus_config.get('PROTOCOL_FILTER', CAN_PROTOCOL_FILTER),
+        # Driver options are interface specific, so an empty list keeps can_options off this bus
+        "OPTIONS": parse_can_options(bus_config['OPTIONS']) if 'OPTIONS' in bus_config else CAN_OPTIONS,
+    }
+
+
+def bus_name(uxr_module):
+    return uxr_module.get('BUS', DEFAULT_BUS)
+
+
+for uxr_module in UXR_MODULES:
+    if bus_name(uxr_module) not in BUS_CONFIGS:
+        sys.exit(f"Module {uxr_module['SERIAL_NR']} uses unknown bus {bus_name(uxr_module)}")
+
+# Power stability is awaited from start-up, by the sweep and by switching on
+power_on_at = time.monotonic() + POWER_ON_DELAY
+
+# Initialize one UXRChargerModule per CAN adapter in use, or per adapter configured when sweeping
+buses = {}
+for name in sorted(BUS_CONFIGS if SCAN_MODULES else {bus_name(uxr_module) for uxr_module in UXR_MODULES}):
+    bus_config = BUS_CONFIGS[name]
+    logging.info(f"Opening {bus_config['INTERFACE']} bus {name} on {bus_config['PORT']} at {bus_config['BITRATE']} bit/s")
+    buses[name] = UXRChargerModule(
+        channel=bus_config['PORT'],
+        bitrate=bus_config['BITRATE'],
+        interface=bus_config['INTERFACE'],
+        can_filters=UXRChargerModule.protocol_filters() if bus_config['PROTOCOL_FILTER'] else None,
+        **bus_config['OPTIONS']
+    )
+
+
+def load_scan_cache():
+    if not os.path.exists(SCAN_CACHE_FILE):
+        return {}
+    try:
+        with open(SCAN_CACHE_FILE) as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logging.error(f"Ignoring unreadable scan cache {SCAN_CACHE_FILE}: {e}")
+        return {}
+
+
+def sweep_reason(name, cached):
+    """
+    Returns why the bus must be swept again, or None if its cached modules can be reused.
+
+    A sweep taken while modules were still booting misses them, so the cache is only
+    trusted while every module in it answers and every module configured on the bus was
+    either found by the sweep or already configured, and missed, when it was taken.
+    """
+    if cached is None:
+        return "nothing cached"
+    if cached['PORT'] != BUS_CONFIGS[name]['PORT']:
+        return "port changed"
+    known_serials = {uxr_module['SERIAL_NR'] for uxr_module in cached['modules']} | set(cached.get('configured', []))
+    for uxr_module in UXR_MODULES:
+        if bus_name(uxr_module) == name and uxr_module['SERIAL_NR'] not in known_serials:
+            return f"configured module {uxr_module['SERIAL_NR']} not cached"
+    expected = {(uxr_module['CANBUS_ID'], uxr_module['GROUP_ID']): int(uxr_module['SERIAL_NR']) for uxr_module in cached['modules']}
+    serial_numbers = buses[name].read_serial_numbers(list(expected), timeout=PROBE_TIMEOUT)
+    silent = [str(serial_no) for key, serial_no in expected.items() if serial_numbers.get(key) != serial_no]
+    if silent:
+        return f"cached modules {', '.join(silent)} not answering"
+    return None
+
+
+def scan_buses():
+    """
+    Returns the modules found on every bus, from the scan cache where it is still valid
+    and by sweeping the bus otherwise.
+
+    A new sweep replaces the bus's cached modules, so modules that were removed are
+    forgotten; configured modules are probed by discovery whether found or not. A sweep
+    that finds nothing, or could not send every request, is never cached.
+
+    Returns:
+        list: Module configs in the same form as the modules option.
+    """
+    cache = load_scan_cache()
+    changed = False
+    scanned = []
+    for name, module in buses.items():
+        port = BUS_CONFIGS[name]['PORT']
+        cached = cache.get(name)
+        reason = sweep_reason(name, cached)
+        if cached is not None and cached['PORT'] != port:
+            cached = None
+        if reason is not None:
+            logging.info(f"Scanning bus {name} for modules, {reason}...")
+            start = time.monotonic()
+            serial_numbers, unsent = module.scan()
+            logging.info(f"Found {len(serial_numbers)} modules on bus {name} in {time.monotonic() - start:.1f}s")
+            modules = [{"SERIAL_NR": str(serial_no), "CANBUS_ID": address, "GROUP_ID": group}
+                       for (address, group), serial_no in sorted(serial_numbers.items())]
+            if unsent:
+                # Modules at the addresses never asked would stay unknown until a cached module stopped answering
+                logging.warning(f"Not caching the sweep of bus {name}, {len(unsent)} requests could not be sent")
+                cached = {"PORT": port, "modules": modules} if modules else None
+                cache.pop(name, None)
+            elif modules:
+                configured = sorted(uxr_module['SERIAL_NR'] for uxr_module in UXR_MODULES if bus_name(uxr_module) == name)
+                cached = {"PORT": port, "modules": modules, "configured": configured}
+                cache[name] = cached
+            else:
+                # An adapter fault looks the same, so the next start sweeps again rather than trusting this
+                logging.warning(f"Not caching the empty sweep of bus {name}")
+                cached = None
+                cache.pop(name, None)
+            changed = True
+        if cached is not None:
+            for uxr_module in cached['modules']:
+                scanned.append(dict(uxr_module, HA_PREFIX="SCAN", BUS=name))
+    if changed:
+        try:
+            with open(SCAN_CACHE_FILE, 'w') as file:
+                json.dump(cache, file, indent=2)
+        except OSError as e:
+            logging.error(f"Could not write scan cache {SCAN_CACHE_FILE}: {e}")
+    return scanned
+
+
+if SCAN_MODULES:
+    # Modules still booting would be missed by the sweep
+    power_wait = power_on_at - time.monotonic()
+    if power_wait > 0:
+        logging.info(f"Waiting {power_wait:.1f} seconds for power stability before scanning")
+        time.sleep(power_wait)
+    # Configured modules take precedence over what the sweep found at the same serial number
+    configured = {uxr_module['SERIAL_NR'] for uxr_module in UXR_MODULES}
+    for uxr_module in scan_buses():
+        if uxr_module['SERIAL_NR'] not in configured:
+            logging.info(f"Adding scanned module {uxr_module['SERIAL_NR']} at address {uxr_module['CANBUS_ID']} "
+                         f"group {uxr_module['GROUP_ID']} on bus {uxr_module['BUS']}")
+            UXR_MODULES.append(uxr_module)
+
+GROUP_IDS = sorted({uxr_module['GROUP_ID'] for uxr_module in UXR_MODULES})
+# Group broadcasts only reach modules on the same bus, so groups are per bus
+BUS_GROUPS = sorted({(bus_name(uxr_module), uxr_module['GROUP_ID']) for uxr_module in UXR_MODULES})
+
+# Keeps the module watchdogs fed independently of the poll rate
+heartbeats = {}
+for name in buses:
+    heartbeats[name] = HeartbeatScheduler(
+        buses[name],
+        [uxr_module for uxr_module in UXR_MODULES if bus_name(uxr_module) == name],
+        period=HEARTBEAT_INTERVAL
+    )
+
+
+# MQTT commands are queued per bus and applied by its poll worker, latest value wins
+write_queues = {name: WriteQueue() for name in buses}
+# Running rollups of every reading, drained by the main loop
+rollups = Rollups(ROLLUP_WINDOWS) if ROLLUP_WINDOWS else None
+# Full-resolution readings, query with history.py
+history = HistoryStore(HISTORY_DIRECTORY, HISTORY_CAPACITY) if HISTORY_ENABLED else None
+# Last published value of every state topic, reset by on_connect so it must exist before the MQTT loop starts
+publish_filter = ChangeFilter()
+# Latest readings of every module
+snapshot = Snapshot()
+
+
+def module_for(uxr_module):
+    """Returns the UXRChargerModule for the bus the module is wired to."""
+    return buses[bus_name(uxr_module)]
 
 initialised_modules = {}
+# Last commanded set-points in MQTT units and power state (1 on, 0 off) by serial number, kept while
+# a module is back in discovery so it returns as it was left; only modules started before are in here
+module_setpoints = {}
+# Last set-points and power state commanded to each (bus, group) as a whole, which modules joining the group start from
+group_setpoints = {}
 
 # MQTT Callbacks
 mqtt_connected = False
+# Command topic -> (module config or group ID, handler), see build_command_routes()
+command_routes = {}
 
 
 def on_connect(client, userdata, flags, rc):
-    global mqtt_connected
+    global mqtt_connected, command_routes
     logging.info("Connected to MQTT broker")
     mqtt_connected = True
-    for uxr_module in UXR_MODULES:
-        serial_no = uxr_module['SERIAL_NR']
-        client.subscribe([
-            (f"{MQTT_BASE_TOPIC}/{serial_no}/set/group_id", 0),
-            (f"{MQTT_BASE_TOPIC}/{serial_no}/set/output_voltage", 0),
-            (f"{MQTT_BASE_TOPIC}/{serial_no}/set/current_limit", 0),
-            (f"{MQTT_BASE_TOPIC}/{serial_no}/set/current", 0),
-            (f"{MQTT_BASE_TOPIC}/{serial_no}/set/power", 0)
-        ])
+    # The broker may have lost non-retained state, so publish everything afresh
+    publish_filter.forget()
+    command_routes = build_command_routes()
+    client.subscribe([(topic, 0) for topic in command_routes])
 
 def on_disconnect(client, userdata, rc):
     if rc != 0:
@@ -78,45 +320,182 @@ def on_disconnect(client, userdata, rc):
     mqtt_connected = False
 
 
+def group_rated_current(bus, group):
+    """Returns the rated current shared by every module in the group, or None if they differ or are unknown."""
+    ratings = set()
+    for uxr_module in UXR_MODULES:
+        if bus_name(uxr_module) != bus or uxr_module['GROUP_ID'] != group:
+            continue
+        if uxr_module['SERIAL_NR'] not in initialised_modules:
+            return None
+        ratings.add(initialised_modules[uxr_module['SERIAL_NR']]['rated_current'])
+    return ratings.pop() if len(ratings) == 1 else None
+
+
+def to_module_units(entry, value, rated_current):
+    """Converts an MQTT value to what the module expects, e.g. amps to a fraction of rated current."""
+    return value / rated_current if entry.scale == RATED_CURRENT else value
+
+
+def from_module_units(entry, value, rated_current):
+    """Converts a value read from the module to what is published on MQTT."""
+    return round(value * rated_current, 2) if entry.scale == RATED_CURRENT else from_raw(entry, value)
+
+
+def remember_group_setpoint(bus, group, name, value):
+    """Records a set-point or power state broadcast to a group on one bus for the group and every module started in it."""
+    group_setpoints.setdefault((bus, group), {})[name] = value
+    for uxr_module in UXR_MODULES:
+        if bus_name(uxr_module) == bus and uxr_module['GROUP_ID'] == group and uxr_module['SERIAL_NR'] in module_setpoints:
+            module_setpoints[uxr_module['SERIAL_NR']][name] = value
+
+
+def set_group_value(entry, bus, group, value):
+    """Applies a set-point to a whole group on one bus, broadcasting it unless it depends on differing ratings."""
+    module = buses[bus]
+    rated_current = group_rated_current(bus, group)
+    if RATED_CURRENT not in (entry.scale, entry.minimum, entry.maximum) or rated_current:
+        if not in_range(entry, value, rated_current):
+            logging.warning(f"Ignoring out of range {entry.name} value {value} for group {group} on bus {bus}")
+            return
+        remember_group_setpoint(bus, group, entry.name, value)
+        getattr(module, f"set_group_{entry.name}")(to_module_units(entry, value, rated_current), group)
+        return
+    # Modules with different ratings need their own fraction of, or check against, rated current;
+    # modules back in discovery have theirs in the metadata cache and get the value when they return
+    group_setpoints.setdefault((bus, group), {})[entry.name] = value
+    for uxr_module in UXR_MODULES:
+        serial_no = uxr_module['SERIAL_NR']
+        if bus_name(uxr_module) != bus or uxr_module['GROUP_ID'] != group or serial_no not in module_setpoints:
+            continue
+        module_rated_current = module_metadata[serial_no]['rated_output_current']
+        if not in_range(entry, value, module_rated_current):
+            logging.warning(f"Ignoring out of range {entry.name} value {value} for {serial_no}")
+            continue
+        module_setpoints[serial_no][entry.name] = value
+        if serial_no in initialised_modules:
+            module_value = to_module_units(entry, value, module_rated_current)
+            getattr(module, f"set_{entry.name}")(module_value, uxr_module['CANBUS_ID'], group)
+
+
+def write_setpoint(uxr_module, entry, value):
+    """Writes a set-point to one module and, with write_readback, confirms it by reading it back."""
+    serial_no = uxr_module['SERIAL_NR']
+    address = uxr_module['CANBUS_ID']
+    group = uxr_module['GROUP_ID']
+    module = module_for(uxr_module)
+    # The module may have gone back to discovery since the command was queued; its rating is still cached
+    rated_current = module_metadata[serial_no]['rated_output_current']
+    if not in_range(entry, value, rated_current):
+        logging.warning(f"Ignoring out of range {entry.name} value {value} for {serial_no}")
+        return
+    module_setpoints[serial_no][entry.name] = value
+    if serial_no not in initialised_modules:
+        logging.info(f"{serial_no} is back in discovery, setting {entry.name} to {value} once it returns")
+        return
+    getattr(module, f"set_{entry.name}")(to_module_units(entry, value, rated_current), address, group)
+    if not WRITE_READBACK or entry.readback is None:
+        return
+    readback = REGISTERS_BY_NAME[entry.readback]
+    reading = getattr(module, f"get_{readback.name}")(address, group)
+    if reading is None:
+        logging.warning(f"No read-back of {entry.name} from {serial_no}")
+        return
+    publish_reading(serial_no, readback, reading)
+    reading = from_module_units(readback, reading, rated_current)
+    if not math.isclose(reading, value, rel_tol=0.01, abs_tol=entry.step or 0):
+        logging.warning(f"{serial_no} reports {entry.name} {reading} after setting {value}")
+
+
+def write_group_power(bus, group, power):
+    """Switches a group on one bus on (1) or off (0), recording it as the power state of its modules."""
+    remember_group_setpoint(bus, group, "power", power)
+    if power:
+        buses[bus].group_power_on_off(0x00000000, group)
+    else:
+        buses[bus].group_power_on_off(0x00010000, group)
+
+
+def write_power(uxr_module, power):
+    """Switches one module on (1) or off (0), recording it as the module's power state."""
+    module_setpoints[uxr_module['SERIAL_NR']]["power"] = power
+    if power:
+        module_for(uxr_module).power_on_off(0x00000000, uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'])
+    else:
+        module_for(uxr_module).power_on_off(0x00010000, uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'])
+
+
+def set_group_power(group, payload):
+    payload = 1 if int(payload) else 0
+    # The MQTT group spans every bus with modules in that group
+    for bus, bus_group in BUS_GROUPS:
+        if bus_group == group:
+            write_queues[bus].put(("group", group, "power"), partial(write_group_power, bus, group, payload))
+    for uxr_module in UXR_MODULES:
+        if uxr_module['GROUP_ID'] == group:
+            publish_now(f"{MQTT_BASE_TOPIC}/{uxr_module['SERIAL_NR']}/power", payload)
+
+
+def set_group_register(entry, group, payload):
+    payload = float(payload)
+    logging.info(f"Setting {entry.name} for group {group} to {payload}")
+    for bus, bus_group in BUS_GROUPS:
+        if bus_group == group:
+            write_queues[bus].put(("group", group, entry.name), partial(set_group_value, entry, bus, group, payload))
+
+
+def set_module_group_id(uxr_module, payload):
+    payload = float(payload)
+    write_queues[bus_name(uxr_module)].put(
+        (uxr_module['SERIAL_NR'], "group_id"),
+        partial(module_for(uxr_module).set_group_id, int(payload), uxr_module['CANBUS_ID'])
+    )
+
+
+def set_module_power(uxr_module, payload):
+    serial_no = uxr_module['SERIAL_NR']
+    payload = 1 if int(payload) else 0
+    write_queues[bus_name(uxr_module)].put((serial_no, "power"), partial(write_power, uxr_module, payload))
+    publish_now(f"{MQTT_BASE_TOPIC}/{serial_no}/power", payload)
+
+
+def set_module_register(entry, uxr_module, payload):
+    serial_no = uxr_module['SERIAL_NR']
+    payload = float(payload)
+    logging.info(f"Setting {entry.name} for {serial_no} to {payload}")
+    write_queues[bus_name(uxr_module)].put((serial_no, entry.name), partial(write_setpoint, uxr_module, entry, payload))
+
+
+def build_command_routes():
+    """Maps every command topic we subscribe to onto its target and handler."""
+    routes = {}
+    for uxr_module in UXR_MODULES:
+        serial_no = uxr_module['SERIAL_NR']
+        routes[f"{MQTT_BASE_TOPIC}/{serial_no}/set/group_id"] = (uxr_module, set_module_group_id)
+        routes[f"{MQTT_BASE_TOPIC}/{serial_no}/set/power"] = (uxr_module, set_module_power)
+        for entry in COMMAND_REGISTERS:
+            routes[f"{MQTT_BASE_TOPIC}/{serial_no}/set/{entry.topic}"] = (uxr_module, partial(set_module_register, entry))
+    for group in GROUP_IDS:
+        routes[f"{MQTT_BASE_TOPIC}/group/{group}/set/power"] = (group, set_group_power)
+        for entry in COMMAND_REGISTERS:
+            routes[f"{MQTT_BASE_TOPIC}/group/{group}/set/{entry.topic}"] = (group, partial(set_group_register, entry))
+    return routes
+
+
 def on_message(client, userdata, msg):
-    with lock:
-        topic = msg.topic
-        for uxr_module in UXR_MODULES:
-            serial_no = uxr_module['SERIAL_NR']
-            address = uxr_module['CANBUS_ID']
-            group = uxr_module['GROUP_ID']
-            if serial_no not in initialised_modules:
-                logging.error(f"Cannot set value for {serial_no} since it is not initialised")
-                return
-
-            # Fetch initialised values
-            rated_current = initialised_modules[serial_no]['rated_current']
-            if topic == f"{MQTT_BASE_TOPIC}/{serial_no}/set/altitude":
-                payload = float(msg.payload.decode())
-                module.set_altitude(payload, address, group)
-            elif topic == f"{MQTT_BASE_TOPIC}/{serial_no}/set/group_id":
-                payload = float(msg.payload.decode())
-                module.set_group_id(int(payload), address)
-            elif topic == f"{MQTT_BASE_TOPIC}/{serial_no}/set/output_voltage":
-                payload = float(msg.payload.decode())
-                logging.info(f"Setting output voltage for {serial_no} to {payload}")
-                module.set_output_voltage(payload, address, group)
-            elif topic == f"{MQTT_BASE_TOPIC}/{serial_no}/set/current_limit":
-                payload = float(msg.payload.decode())
-                percentage = payload / rated_current
-                logging.info("Current limit set: {} for {}%".format(percentage, serial_no))
-                module.set_current_limit(percentage, address, group)
-            elif topic == f"{MQTT_BASE_TOPIC}/{serial_no}/set/current":
-                payload = float(msg.payload.decode())
-                module.set_output_current(payload, address, group)
-            elif topic == f"{MQTT_BASE_TOPIC}/{serial_no}/set/power":
-                payload = int(msg.payload.decode())
-                if payload:
-                    module.power_on_off(0x00000000, address, group)
-                else:
-                    module.power_on_off(0x00010000, address, group)
-                power_topic = f"{MQTT_BASE_TOPIC}/{serial_no}/power"
-                client.publish(power_topic, payload)
+    route = command_routes.get(msg.topic)
+    if route is None:
+        logging.debug(f"Ignoring message on {msg.topic}")
+        return
+    target, handler = route
+    # Module commands need the module's ratings, other modules are unaffected
+    if isinstance(target, dict) and target['SERIAL_NR'] not in initialised_modules:
+        logging.error(f"Cannot set value for {target['SERIAL_NR']} since it is not initialised")
+        return
+    try:
+        handler(target, msg.payload.decode())
+    except ValueError as e:
+        logging.error(f"Invalid payload on {msg.topic}: {e}")
 
 # Initialize MQTT client
 client = mqtt.Client()
@@ -127,98 +506,76 @@ client.username_pw_set(username=MQTT_USER, password=MQTT_PASSWORD)
 client.connect(MQTT_BROKER, MQTT_PORT, 60)
 client.loop_start()
 
-def keep_alive():
-    # Turn on
-    for uxr_module in UXR_MODULES:
-        module.get_input_power(uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'])
-        time.sleep(READ_DELAY)
+
+def publish_now(topic, value):
+    """Publishes a state value unconditionally, recording it so publish_state() compares against what the broker has."""
+    publish_filter.record(topic, value)
+    client.publish(topic, value)
+
 
 def turn_on():
-    for i in range(0, 5):
-        time.sleep(1)
-        for uxr_module in UXR_MODULES:
-            serial_no = uxr_module['SERIAL_NR']
-            address = uxr_module['CANBUS_ID']
-            client.publish(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "offline")
-            logging.info(f"Switching on Serial: {serial_no} on Canbus ID: {address}")
-            module.power_on_off(0x00000000, address, uxr_module['GROUP_ID'])
-            time.sleep(READ_DELAY)
-
-
-logging.info(f"Waiting 5 seconds for power stability before switching on chargers")
-# Wait 5 seconds for startup
-time.sleep(5)
-# Switch on chargers
-logging.info(f"Switching on chargers...")
-turn_on()
-logging.info(f"Chargers switched on")
-
-MAX_ATTEMPTS = 1500
-
-# Function to read the serial number with retries
-def get_serial_number_with_retries(module, address, group):
-    for attempt in range(MAX_ATTEMPTS):
-        serial_no = module.get_serial_number(address, group)
-        
-        if serial_no:  # If the serial number is successfully read
-            return str(serial_no)
-        
-        # Log the attempt and wait before retrying
-        logging.error(f"Attempt {attempt + 1} failed, retrying...")
+    logging.info(f"Switching on chargers...")
+    for bus, group in BUS_GROUPS:
+        logging.info(f"Switching on group {group} on bus {bus}")
+        for attempt in range(1, TURN_ON_ATTEMPTS + 1):
+            try:
+                write_group_power(bus, group, 1)
+                break
+            except Exception as e:
+                logging.error(f"Switching on group {group} on bus {bus} failed, attempt {attempt} of {TURN_ON_ATTEMPTS}: {e}")
+                time.sleep(1)
         time.sleep(READ_DELAY)
-    
-    # If all attempts fail, return None or raise an exception
-    logging.error(f"Failed to read serial number after {MAX_ATTEMPTS} attempts.")
-    return None
+    logging.info(f"Chargers switched on")
 
 
-# Loop through each address in the list and create an entry in the devices dictionary
 for uxr_module in UXR_MODULES:
-    address = uxr_module['CANBUS_ID']
-    group = uxr_module['GROUP_ID']
-    expected_serial_no = uxr_module['SERIAL_NR']
-    serial_no = get_serial_number_with_retries(module, address, group)
-    if serial_no == None:
-        raise ValueError(f"Failed to read serial number after {MAX_ATTEMPTS} attempts.")
-    if serial_no != expected_serial_no:
-        raise ValueError(f"Serial no {serial_no} found expected {expected_serial_no}")
-    time.sleep(READ_DELAY)
-    rated_power = module.get_rated_output_power(address, group)
-    time.sleep(READ_DELAY)
-    rated_current = module.get_rated_output_current(address, group)
-    time.sleep(READ_DELAY)
-    initialised_modules[serial_no] = {
-        "rated_power": rated_power,
-        "rated_current": rated_current,
-        "serial_no": serial_no
-    }
-    time.sleep(READ_DELAY)
-
-
-    logging.info(f"Serial No: {serial_no}")
-    logging.info(f"Address: {address} ")
-    logging.info(f"Rated Output Power: {rated_power} W")
-    logging.info(f"Rated Output Current: {rated_current} A")
+    publish_now(f"{MQTT_BASE_TOPIC}_{uxr_module['SERIAL_NR']}/availability", "offline")
+# Discovery and polling start right away, only switching on waits for power stability;
+# discovery repeats this for modules that do not answer yet
+power_wait = max(power_on_at - time.monotonic(), 0)
+logging.info(f"Switching on chargers in {power_wait:.1f} seconds")
+power_on_timer = threading.Timer(power_wait, turn_on)
+power_on_timer.daemon = True
+power_on_timer.start()
 
-    # Set defaults
-    module.set_current_limit(DEFAULT_CURRENT/rated_current, address, group)
-    time.sleep(READ_DELAY)
-    logging.info(f"Setting default voltage for {serial_no} to {DEFAULT_VOLTAGE}V")
-    module.set_output_voltage(DEFAULT_VOLTAGE, address, group)
 
+def load_metadata_cache():
+    if not os.path.exists(METADATA_CACHE_FILE):
+        return {}
+    try:
+        with open(METADATA_CACHE_FILE) as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logging.error(f"Ignoring unreadable metadata cache {METADATA_CACHE_FILE}: {e}")
+        return {}
 
 
-lock = threading.Lock()  # Create a lock
+module_metadata = load_metadata_cache()
+metadata_lock = threading.Lock()
 
 
+def remember_metadata(serial_no, metadata):
+    """Adds a module's static data to the metadata cache and writes it out."""
+    with metadata_lock:
+        module_metadata[serial_no] = metadata
+        try:
+            with open(METADATA_CACHE_FILE, 'w') as file:
+                json.dump(module_metadata, file, indent=2)
+        except OSError as e:
+            logging.error(f"Could not write metadata cache {METADATA_CACHE_FILE}: {e}")
 
 
 # Clean up on exit
 def exit_handler():
     logging.error("Script exiting")
+    power_on_timer.cancel()
+    for heartbeat in heartbeats.values():
+        heartbeat.stop()
+    if history is not None:
+        history.flush()
     for uxr_module in UXR_MODULES:
         serial_no = uxr_module['SERIAL_NR']
-        client.publish(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "offline")
+        publish_now(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "offline")
     client.loop_stop()
 
 atexit.register(exit_handler)
@@ -234,67 +591,53 @@ def ha_discovery(serial_no):
             "identifiers": [f"uxr_charger_{serial_no}"],
             "name": f"UXR Charger {serial_no}"
         }
+        metadata = initialised_modules[serial_no]
+        if metadata.get('dcdc_version') is not None and metadata.get('pfc_version') is not None:
+            device["sw_version"] = f"DCDC {metadata['dcdc_version']} PFC {metadata['pfc_version']}"
 
         # Base availability topic
         availability_topic = f"{MQTT_BASE_TOPIC}_{serial_no}/availability"
 
-        # Define all sensor parameters and publish discovery messages
-        parameters = {
-            "Module Voltage": {"device_class": "voltage", "unit": "V"},
-            "Module Current": {"device_class": "current", "unit": "A"},
-            "Rated Current": {"device_class": "current", "unit": "A"},
-            "Rated Power": {"device_class": "current", "unit": "W"},
-            "Current Limit": {"device_class": "current", "unit": "A"},
-            "Temperature of DC Board": {"device_class": "temperature", "unit": "°C"},
-            "Input Phase Voltage": {"device_class": "voltage", "unit": "V"},
-            "PFC0 Voltage": {"device_class": "voltage", "unit": "V"},
-            "PFC1 Voltage": {"device_class": "voltage", "unit": "V"},
-            "Panel Board Temperature": {"device_class": "temperature", "unit": "°C"},
-            "Voltage Phase A": {"device_class": "voltage", "unit": "V"},
-            "Voltage Phase B": {"device_class": "voltage", "unit": "V"},
-            "Voltage Phase C": {"device_class": "voltage", "unit": "V"},
-            "Temperature of PFC Board": {"device_class": "temperature", "unit": "°C"},
-            "Input Power": {"device_class": "power", "unit": "W"},
-            "Current Altitude": {"device_class": "none", "unit": "m"},
-            "Input Working Mode": {"device_class": "none", "unit": None},
-            "Alarm Status": {"device_class": "none", "unit": None}
-        }
-
-        for param, details in parameters.items():
+        # Publish a sensor for every read-only register in the register map
+        for entry in SENSOR_REGISTERS:
+            object_id = entry.label.replace(' ', '_').lower()
             discovery_payload = {
-                "name": param,
-                "unique_id": f"uxr_{serial_no}_{param.replace(' ', '_').lower()}",
-                "state_topic": f"{MQTT_BASE_TOPIC}/{serial_no}/{param.replace(' ', '_').lower()}",
+                "name": entry.label,
+                "unique_id": f"uxr_{serial_no}_{object_id}",
+                "state_topic": f"{MQTT_BASE_TOPIC}/{serial_no}/{entry.topic}",
                 "availability_topic": availability_topic,
                 "device": device,
-                "device_class": details.get("device_class"),
-                "unit_of_measurement": details.get("unit"),
+                "device_class": entry.device_class,
+                "unit_of_measurement": entry.unit,
             }
-            discovery_topic = f"{MQTT_HA_DISCOVERY_TOPIC}/sensor/uxr_{serial_no}/{param.replace(' ', '_').lower()}/config"
+            if rollups is not None and entry in POLLED_REGISTERS:
+                # The shortest rollup stands in for the reading: the mean of measurements, the last of states
+                rollup_topic = f"{MQTT_BASE_TOPIC}/{serial_no}/{entry.topic}/rollup/{ROLLUP_WINDOWS[0]:g}"
+                discovery_payload["state_topic"] = rollup_topic
+                discovery_payload["value_template"] = "{{ value_json.mean }}" if entry.unit else "{{ value_json.last }}"
+                discovery_payload["json_attributes_topic"] = rollup_topic
+            elif STATE_JSON:
+                discovery_payload["state_topic"] = f"{MQTT_BASE_TOPIC}/{serial_no}/state"
+                discovery_payload["value_template"] = f"{{{{ value_json.{entry.topic} }}}}"
+            discovery_topic = f"{MQTT_HA_DISCOVERY_TOPIC}/sensor/uxr_{serial_no}/{object_id}/config"
             client.publish(discovery_topic, json.dumps(discovery_payload), retain=True)
 
-        # Define settable parameters as MQTT number entities
-        settable_parameters = {
-            "Current Limit": {"min": 0, "max": rated_current, "step": 0.1, "unit": "A", "command_topic": f"{MQTT_BASE_TOPIC}/{serial_no}/set/current_limit"},
-            "Output Voltage": {"min": 735, "max": 810, "step": 0.1, "unit": "V", "command_topic": f"{MQTT_BASE_TOPIC}/{serial_no}/set/output_voltage"},
-            "Output Current": {"min": 0, "max": rated_current, "step": 0.1, "unit": "A", "command_topic": f"{MQTT_BASE_TOPIC}/{serial_no}/set/current"},
-            "Altitude": {"min": 0, "max": 5000, "step": 100, "unit": "m", "command_topic": f"{MQTT_BASE_TOPIC}/{serial_no}/set/altitude"},
-        }
-
-        # Publish discovery messages for settable parameters
-        for param, details in settable_parameters.items():
+        # Publish a number entity for every settable register
+        rated_current = initialised_modules[serial_no]['rated_current']
+        for entry in COMMAND_REGISTERS:
+            object_id = entry.label.replace(' ', '_').lower()
             discovery_payload = {
-                "name": param,
-                "unique_id": f"uxr_{serial_no}_{param.replace(' ', '_').lower()}",
-                "command_topic": details["command_topic"],
-                "min": details["min"],
-                "max": details["max"],
-                "step": details["step"],
-                "unit_of_measurement": details["unit"],
+                "name": entry.label,
+                "unique_id": f"uxr_{serial_no}_{object_id}",
+                "command_topic": f"{MQTT_BASE_TOPIC}/{serial_no}/set/{entry.topic}",
+                "min": rated_current if entry.minimum == RATED_CURRENT else entry.minimum,
+                "max": rated_current if entry.maximum == RATED_CURRENT else entry.maximum,
+                "step": entry.step,
+                "unit_of_measurement": entry.unit,
                 "availability_topic": availability_topic,
                 "device": device
             }
-            discovery_topic = f"{MQTT_HA_DISCOVERY_TOPIC}/number/uxr_{serial_no}/{param.replace(' ', '_').lower()}/config"
+            discovery_topic = f"{MQTT_HA_DISCOVERY_TOPIC}/number/uxr_{serial_no}/{object_id}/config"
             client.publish(discovery_topic, json.dumps(discovery_payload), retain=True)
 
 
@@ -322,180 +665,541 @@ def ha_discovery(serial_no):
 
         # Optionally publish the initial state
         state_topic = f"{MQTT_BASE_TOPIC}/{serial_no}/{switch_name.lower()}"
-        client.publish(state_topic, 1)
+        publish_now(state_topic, module_setpoints[serial_no]["power"])
 
-        client.publish(availability_topic, "online")
+        publish_now(availability_topic, "online")
 
 
 
-# Main loop to continuously read parameters
-try:
+# Seconds between reads of each register, overridable with the poll_intervals option
+POLL_INTERVALS = {entry.topic: entry.poll_interval for entry in POLLED_REGISTERS}
+for entry in config.get('poll_intervals', []):
+    if entry['REGISTER'] not in POLL_INTERVALS:
+        logging.error(f"Unknown register {entry['REGISTER']} in poll_intervals")
+        continue
+    POLL_INTERVALS[entry['REGISTER']] = entry['INTERVAL']
+
+POLLED_BY_REGISTER = {entry.register: entry for entry in POLLED_REGISTERS}
+MODULES_BY_ADDRESS = {(bus_name(uxr_module), uxr_module['CANBUS_ID'], uxr_module['GROUP_ID']): uxr_module for uxr_module in UXR_MODULES}
+
+# Each bus has its own timetable, polled by its own worker thread; modules are added as they are discovered
+poll_schedules = {name: PollScheduler() for name in buses}
+
+# Monotonic time of each module's last reply and last status publish
+last_reply = {}
+last_status = {}
+
+
+# Deadbands and max age by state topic from the register table, overridable with the publish_filters option
+PUBLISH_FILTERS = {
+    entry.topic: (entry.deadband, entry.relative_deadband, entry.max_age or PUBLISH_MAX_AGE)
+    for entry in REGISTERS if not entry.writable
+}
+for entry in AGGREGATES:
+    PUBLISH_FILTERS[entry.topic] = (entry.deadband, None, PUBLISH_MAX_AGE)
+for entry in config.get('publish_filters', []):
+    if entry['REGISTER'] not in PUBLISH_FILTERS:
+        logging.error(f"Unknown register {entry['REGISTER']} in publish_filters")
+        continue
+    deadband, relative_deadband, max_age = PUBLISH_FILTERS[entry['REGISTER']]
+    PUBLISH_FILTERS[entry['REGISTER']] = (
+        entry.get('DEADBAND', deadband),
+        entry.get('RELATIVE_DEADBAND', relative_deadband),
+        entry.get('MAX_AGE', max_age),
+    )
+
+def publish_state(topic, value, filter_topic=None):
+    """Publishes a state value, unless publish_on_change holds it back as unchanged."""
+    if PUBLISH_ON_CHANGE:
+        deadband, relative_deadband, max_age = PUBLISH_FILTERS.get(filter_topic, (None, None, PUBLISH_MAX_AGE))
+        if not publish_filter.should_publish(topic, value, deadband, relative_deadband, max_age):
+            return
+    client.publish(topic, value)
+
+
+def publish_reading(serial_no, entry, value):
+    value = from_module_units(entry, value, initialised_modules[serial_no]['rated_current'])
+    snapshot.update(serial_no, entry.topic, value)
+    if history is not None:
+        history.append(serial_no, entry.topic, value)
+    if rollups is not None:
+        rollups.add((serial_no, entry.topic), value)
+    elif not STATE_JSON:
+        publish_state(f"{MQTT_BASE_TOPIC}/{serial_no}/{entry.topic}", value, entry.topic)
+    logging.debug(f"{serial_no} {entry.topic}: {value}")
+    if entry.name == "input_power":
+        power = 1 if value > 0 else 0
+        snapshot.update(serial_no, "power", power)
+        # The power switch keeps its own topic so command echoes reach it
+        publish_state(f"{MQTT_BASE_TOPIC}/{serial_no}/power", power)
+
+
+def publish_module_state(serial_no):
+    """Publishes the module's latest readings as one JSON document, if any of them is due under publish_on_change."""
+    values = snapshot.module(serial_no)
+    if not values:
+        return
+    if PUBLISH_ON_CHANGE:
+        # Check every field, so each one's last published value is recorded
+        due = [
+            publish_filter.should_publish(f"{MQTT_BASE_TOPIC}/{serial_no}/{topic}", value,
+                                          *PUBLISH_FILTERS.get(topic, (None, None, PUBLISH_MAX_AGE)))
+            for topic, value in values.items()
+        ]
+        if not any(due):
+            return
+    values["timestamp"] = round(snapshot.updated_at(serial_no), 3)
+    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/state", json.dumps(values))
+
+
+def publish_status():
+    """Every scan_interval, publishes each module's ratings and whether it answered since the last time."""
+    now = time.monotonic()
     for uxr_module in UXR_MODULES:
+        serial_no = uxr_module['SERIAL_NR']
+        if serial_no not in initialised_modules:
+            continue
+        previous = last_status.get(serial_no)
+        if previous is not None and now - previous < SCAN_INTERVAL:
+            continue
+        last_status[serial_no] = now
+        if not STATE_JSON:
+            publish_state(f"{MQTT_BASE_TOPIC}/{serial_no}/rated_current", initialised_modules[serial_no]['rated_current'], "rated_current")
+            publish_state(f"{MQTT_BASE_TOPIC}/{serial_no}/rated_power", initialised_modules[serial_no]['rated_power'], "rated_power")
+        if previous is None:
+            continue
+        if last_reply.get(serial_no, 0) >= previous:
+            publish_state(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "online")
+        else:
+            logging.warning(f"No reply from {serial_no} in the last {SCAN_INTERVAL}s")
+            publish_state(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "offline")
+
+
+def probe_modules(bus, missing):
+    """
+    Probes modules that have not answered yet, pipelining the reads across all of them.
+
+    A module whose serial number is in the metadata cache needs only the serial read;
+    the rest also have whichever of their ratings and firmware versions are not cached
+    read and cached. A module is started once its ratings are known, and a missing
+    firmware version is read again the next time the module is probed.
+
+    Parameters:
+        bus (str): Name of the bus the modules are on.
+        missing (list): Module configs from the modules option.
+
+    Returns:
+        list: (module config, metadata) for each module that answered with its
+        configured serial number.
+    """
+    module = buses[bus]
+    # Modules that came up after turn_on() still need switching on, or off if their group was last
+    # switched off, one at a time so running modules keep the power state an operator gave them;
+    # a module started before gets its own power state back from start_modules() instead
+    if time.monotonic() >= power_on_at:
+        for uxr_module in missing:
+            if uxr_module['SERIAL_NR'] in module_setpoints:
+                continue
+            if group_setpoints.get((bus, uxr_module['GROUP_ID']), {}).get("power", 1):
+                module.power_on_off(0x00000000, uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'])
+            else:
+                module.power_on_off(0x00010000, uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'])
+    serial_numbers = module.read_serial_numbers([(uxr_module['CANBUS_ID'], uxr_module['GROUP_ID']) for uxr_module in missing],
+                                                timeout=PROBE_TIMEOUT)
+    answered = []
+    for uxr_module in missing:
+        serial_no = serial_numbers.get((uxr_module['CANBUS_ID'], uxr_module['GROUP_ID']))
+        if serial_no is None:
+            continue
+        if str(serial_no) != uxr_module['SERIAL_NR']:
+            logging.error(f"Serial no {serial_no} found at address {uxr_module['CANBUS_ID']} on bus {bus}, expected {uxr_module['SERIAL_NR']}")
+            continue
+        answered.append(uxr_module)
+    # Only fields not cached yet are read, so a read that timed out is retried on the next probe
+    entries = [REGISTERS_BY_NAME[name] for name in METADATA_REGISTERS]
+    unread = {
+        uxr_module['SERIAL_NR']: [entry for entry in entries if module_metadata.get(uxr_module['SERIAL_NR'], {}).get(entry.name) is None]
+        for uxr_module in answered
+    }
+    values, _, _ = module.read_many([
+        (uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'], entry.register, entry.is_float)
+        for uxr_module in answered for entry in unread[uxr_module['SERIAL_NR']]
+    ], timeout=PROBE_TIMEOUT)
+    found = []
+    for uxr_module in answered:
+        serial_no = uxr_module['SERIAL_NR']
+        metadata = {entry.name: None for entry in entries}
+        metadata.update(module_metadata.get(serial_no, {}))
+        for entry in unread[serial_no]:
+            metadata[entry.name] = values.get((uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'], entry.register))
+        if metadata['rated_output_power'] is None or not metadata['rated_output_current']:
+            continue
+        if metadata != module_metadata.get(serial_no):
+            remember_metadata(serial_no, metadata)
+        found.append((uxr_module, metadata))
+    return found
+
+
+def restore_module(uxr_module):
+    """Writes a module's recorded set-points and, once power is stable, its power state to it."""
+    module = module_for(uxr_module)
+    address = uxr_module['CANBUS_ID']
+    group = uxr_module['GROUP_ID']
+    setpoints = module_setpoints[uxr_module['SERIAL_NR']]
+    rated_current = initialised_modules[uxr_module['SERIAL_NR']]['rated_current']
+    for entry in COMMAND_REGISTERS:
+        value = setpoints.get(entry.name)
+        if value is None:
+            continue
+        # A value commanded to the group may not suit this module's rating
+        if not in_range(entry, value, rated_current):
+            logging.warning(f"Not restoring out of range {entry.name} value {value} to {uxr_module['SERIAL_NR']}")
+            continue
+        getattr(module, f"set_{entry.name}")(to_module_units(entry, value, rated_current), address, group)
+    # Before then turn_on() switches the whole group on
+    if time.monotonic() >= power_on_at:
+        if setpoints["power"]:
+            module.power_on_off(0x00000000, address, group)
+        else:
+            module.power_on_off(0x00010000, address, group)
+
+
+def start_modules(bus, found):
+    """
+    Applies the last commanded set-points and power state to modules returning from
+    discovery, and to new modules those last commanded to their group over the defaults,
+    then announces them to Home Assistant and starts polling them.
+    """
+    module = buses[bus]
+    returning = [uxr_module for uxr_module, _ in found if uxr_module['SERIAL_NR'] in module_setpoints]
+    new = [uxr_module for uxr_module, _ in found if uxr_module['SERIAL_NR'] not in module_setpoints]
+    # Groups no module was started in yet get their defaults as one broadcast so the modules change together
+    started_groups = {uxr_module['GROUP_ID'] for uxr_module in UXR_MODULES
+                      if bus_name(uxr_module) == bus and uxr_module['SERIAL_NR'] in module_setpoints}
+    for uxr_module, metadata in found:
+        serial_no = uxr_module['SERIAL_NR']
+        initialised_modules[serial_no] = {
+            "rated_power": metadata['rated_output_power'],
+            "rated_current": metadata['rated_output_current'],
+            "dcdc_version": metadata['dcdc_version'],
+            "pfc_version": metadata['pfc_version'],
+            "serial_no": serial_no
+        }
+        snapshot.update(serial_no, "rated_current", metadata['rated_output_current'])
+        snapshot.update(serial_no, "rated_power", metadata['rated_output_power'])
+        logging.info(f"Serial No: {serial_no}")
+        logging.info(f"Address: {uxr_module['CANBUS_ID']} ")
+        logging.info(f"Rated Output Power: {metadata['rated_output_power']} W")
+        logging.info(f"Rated Output Current: {metadata['rated_output_current']} A")
+
+    try:
+        for uxr_module in returning:
+            logging.info(f"Restoring set-points of {uxr_module['SERIAL_NR']}: {module_setpoints[uxr_module['SERIAL_NR']]}")
+            restore_module(uxr_module)
+        # New modules are switched on or off by turn_on() or probe_modules()
+        for uxr_module in new:
+            setpoints = {"current_limit": DEFAULT_CURRENT, "output_voltage": DEFAULT_VOLTAGE, "power": 1}
+            setpoints.update(group_setpoints.get((bus, uxr_module['GROUP_ID']), {}))
+            module_setpoints[uxr_module['SERIAL_NR']] = setpoints
+        for group in sorted({uxr_module['GROUP_ID'] for uxr_module in new} - started_groups):
+            setpoints = module_setpoints[next(uxr_module['SERIAL_NR'] for uxr_module in new if uxr_module['GROUP_ID'] == group)]
+            logging.info(f"Setting group {group} on bus {bus} to {setpoints}")
+            for entry in COMMAND_REGISTERS:
+                if setpoints.get(entry.name) is not None:
+                    set_group_value(entry, bus, group, setpoints[entry.name])
+        for uxr_module in new:
+            if uxr_module['GROUP_ID'] in started_groups:
+                restore_module(uxr_module)
+    except Exception:
+        # Undone so discovery probes and starts them again, rather than leaving them initialised but never polled
+        for uxr_module, _ in found:
+            initialised_modules.pop(uxr_module['SERIAL_NR'], None)
+        for uxr_module in new:
+            module_setpoints.pop(uxr_module['SERIAL_NR'], None)
+        raise
+
+    requests = []
+    for uxr_module, _ in found:
         ha_discovery(uxr_module['SERIAL_NR'])
+        for entry in POLLED_REGISTERS:
+            request = (uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'], entry.register, entry.is_float)
+            poll_schedules[bus].add(request, POLL_INTERVALS[entry.topic])
+            requests.append(request)
+    # The polled set only grows here, so build its request frames once up front
+    module.prepare_frames(requests)
+
+
+# Set by a poll worker when it returns a module to discovery
+rediscover = {name: threading.Event() for name in buses}
+
+
+def discover_bus(name):
+    """
+    Probes the modules on one bus until every one has answered, starting each as soon as it does.
+
+    Silent modules are probed again with exponential backoff, so one dead module delays
+    no others; after discovery_timeout they are reported but probing carries on. A module
+    the poll worker hands back because it went quiet is probed again at once, with the
+    backoff reset, whether or not other modules are still missing. A round that fails,
+    e.g. on a bus error, is logged and retried after the backoff.
+    """
+    modules = [uxr_module for uxr_module in UXR_MODULES if bus_name(uxr_module) == name]
+    probe_delay = DISCOVERY_MIN_DELAY
+    deadline = time.monotonic() + DISCOVERY_TIMEOUT
     while True:
-        for uxr_module in UXR_MODULES:
-            serial_no = uxr_module['SERIAL_NR']
-            address = uxr_module['CANBUS_ID']
-            group = uxr_module['GROUP_ID']
-            logging.info("====================")
-            logging.info(f"Serial: {serial_no}")
-            logging.info(f"Address: {address}")
-            alive = False
-            # Use lock to ensure thread safety for each sensor reading and publishing
-            with lock:
-                keep_alive()
-                voltage = module.get_module_voltage(address, group)
-                if voltage is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/module_voltage", voltage)
-                    logging.info(f"module_voltage: {voltage}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                current = module.get_module_current(address, group)
-                if current is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/module_current", current)
-                    logging.info(f"module_current: {current}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                current_limit = module.get_module_current_limit(address, group)
-                if current_limit is not None:
-                    current_limit = round(current_limit * rated_current, 2)
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/current_limit", current_limit)
-                    logging.info(f"current_limit: {current_limit}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                temp_dc_board = module.get_temperature_dc_board(address, group)
-                if temp_dc_board is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/temperature_of_dc_board", temp_dc_board)
-                    logging.info(f"temperature_of_dc_board: {temp_dc_board}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                input_voltage = module.get_input_phase_voltage(address, group)
-                if input_voltage is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/input_phase_voltage", input_voltage)
-                    logging.info(f"input_phase_voltage: {input_voltage}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                pfc0_voltage = module.get_pfc0_voltage(address, group)
-                if pfc0_voltage is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/pfc0_voltage", pfc0_voltage)
-                    logging.info(f"pfc0_voltage: {pfc0_voltage}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                pfc1_voltage = module.get_pfc1_voltage(address, group)
-                if pfc1_voltage is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/pfc1_voltage", pfc1_voltage)
-                    logging.info(f"pfc1_voltage: {pfc1_voltage}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                panel_temp = module.get_panel_board_temperature(address, group)
-                if panel_temp is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/panel_board_temperature", panel_temp)
-                    logging.info(f"panel_board_temperature: {panel_temp}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                voltage_phase_a = module.get_voltage_phase_a(address, group)
-                if voltage_phase_a is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/voltage_phase_a", voltage_phase_a)
-                    logging.info(f"voltage_phase_a: {voltage_phase_a}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                voltage_phase_b = module.get_voltage_phase_b(address, group)
-                if voltage_phase_b is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/voltage_phase_b", voltage_phase_b)
-                    logging.info(f"voltage_phase_b: {voltage_phase_b}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                voltage_phase_c = module.get_voltage_phase_c(address, group)
-                if voltage_phase_c is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/voltage_phase_c", voltage_phase_c)
-                    logging.info(f"voltage_phase_c: {voltage_phase_c}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                temp_pfc_board = module.get_temperature_pfc_board(address, group)
-                if temp_pfc_board is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/temperature_of_pfc_board", temp_pfc_board)
-                    logging.info(f"temperature_of_pfc_board: {temp_pfc_board}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                input_power = module.get_input_power(address, group)
-                if input_power is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/input_power", input_power)
-                    logging.info(f"input_power: {input_power}")
-                    power = 1
-                    if input_power > 0:
-                        power = 1
-                    else:
-                        power = 0
-                    power_topic = f"{MQTT_BASE_TOPIC}/{serial_no}/power"
-                    client.publish(power_topic, power)
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                altitude_value = module.get_current_altitude_value(address, group)
-                if altitude_value is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/current_altitude", altitude_value)
-                    logging.info(f"altitude_value: {altitude_value}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-            with lock:
-                keep_alive()
-                input_mode = module.get_input_working_mode(address, group)
-                if input_mode is not None:
-                    client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/input_working_mode", input_mode)
-                    logging.info(f"input_working_mode: {input_mode}")
-                    alive = True
-            time.sleep(READ_DELAY)
-
-
-            client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/rated_current", rated_current)
-            client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/rated_power", rated_power)
-            if alive:
-                client.publish(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "online")
-            else:
-                client.publish(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "offline")
+        # Rebuilt every round, so modules handed back meanwhile are probed alongside the ones still missing
+        missing = [uxr_module for uxr_module in modules if uxr_module['SERIAL_NR'] not in initialised_modules]
+        if missing:
+            try:
+                start_modules(name, probe_modules(name, missing))
+            except Exception as e:
+                logging.error(f"Discovery round on bus {name} failed: {e}")
+                logging.error("Traceback: %s", traceback.format_exc())
+            missing = [uxr_module for uxr_module in missing if uxr_module['SERIAL_NR'] not in initialised_modules]
+            if not missing:
+                logging.info(f"All modules on bus {name} found")
+            elif deadline is not None and time.monotonic() >= deadline:
+                logging.error(f"{len(missing)} modules on bus {name} not found within {DISCOVERY_TIMEOUT}s, still retrying: "
+                              f"{', '.join(uxr_module['SERIAL_NR'] for uxr_module in missing)}")
+                deadline = None
+        # Sleeps out the backoff, or until then while nothing is missing, unless a module is handed back
+        if rediscover[name].wait(probe_delay if missing else None):
+            rediscover[name].clear()
+            probe_delay = DISCOVERY_MIN_DELAY
+            deadline = time.monotonic() + DISCOVERY_TIMEOUT
+        else:
+            probe_delay = min(probe_delay * 2, DISCOVERY_MAX_DELAY)
+
+
+def return_to_discovery(name, uxr_module):
+    """Stops polling a module that no longer answers and has discovery probe it until it does."""
+    serial_no = uxr_module['SERIAL_NR']
+    logging.warning(f"{serial_no} missed {POLL_MAX_MISSES} poll passes on bus {name}, returning it to discovery")
+    module_key = (uxr_module['CANBUS_ID'], uxr_module['GROUP_ID'])
+    poll_schedules[name].remove(lambda request: request[:2] == module_key)
+    initialised_modules.pop(serial_no, None)
+    # Status starts afresh once discovery finds the module again
+    last_status.pop(serial_no, None)
+    publish_state(f"{MQTT_BASE_TOPIC}_{serial_no}/availability", "offline")
+    rediscover[name].set()
+
+
+# Poll worker totals per bus for the metrics endpoint, each written only by its bus's worker
+poll_stats = {
+    name: {"cycles": 0, "reads": 0, "timeouts": 0, "unsent": 0, "writes": 0, "cycle_seconds": 0.0, "cycle_seconds_total": 0.0}
+    for name in buses
+}
+
+
+def poll_bus(name):
+    """
+    Reads each register on one bus as it comes due, publishing through the shared MQTT client,
+    and applies queued commands between reads.
+    """
+    module = buses[name]
+    poll_schedule = poll_schedules[name]
+    write_queue = write_queues[name]
+    stats = poll_stats[name]
+    # Serial number -> poll passes in a row in which the module answered nothing
+    misses = {}
+    try:
+        while True:
+            # Queued commands go first, so they wait for at most one poll pass
+            writes = write_queue.take()
+            stats["writes"] += len(writes)
+            for write in writes:
+                try:
+                    write()
+                except Exception as e:
+                    logging.error(f"Write on bus {name} failed: {e}")
+            if writes:
+                # Pace command batches so values arriving meanwhile replace each other
+                time.sleep(READ_DELAY)
+            requests = poll_schedule.pop_due()
+            if requests:
+                started = time.monotonic()
+                try:
+                    results, timed_out, unsent = module.read_many(requests, timeout=POLL_TIMEOUT + module.bus_time(len(requests)))
+                except can.CanError as e:
+                    # A bus error loses this pass only, the next one retries
+                    logging.error(f"Polling bus {name} failed: {e}")
+                    results, timed_out, unsent = {}, [], [request[:3] for request in requests]
+                # Unsent reads were never put to the module, so they count as neither a reply nor a miss
+                if unsent:
+                    logging.warning(f"{len(unsent)} of {len(requests)} reads could not be sent on bus {name}")
+                if timed_out:
+                    logging.warning(f"{len(timed_out)} of {len(requests)} reads timed out on bus {name}")
+                now = time.monotonic()
+                updated = set()
+                answered = set()
+                for (address, group, register), value in results.items():
+                    serial_no = MODULES_BY_ADDRESS[(name, address, group)]['SERIAL_NR']
+                    last_reply[serial_no] = now
+                    answered.add(serial_no)
+                    if value is not None:
+                        publish_reading(serial_no, POLLED_BY_REGISTER[register], value)
+                        updated.add(serial_no)
+                if STATE_JSON:
+                    for serial_no in updated:
+                        publish_module_state(serial_no)
+                for serial_no in answered:
+                    misses.pop(serial_no, None)
+                silent = {}
+                for address, group, _ in timed_out:
+                    uxr_module = MODULES_BY_ADDRESS[(name, address, group)]
+                    silent[uxr_module['SERIAL_NR']] = uxr_module
+                for serial_no, uxr_module in silent.items():
+                    if serial_no in answered or serial_no not in initialised_modules:
+                        continue
+                    misses[serial_no] = misses.get(serial_no, 0) + 1
+                    if misses[serial_no] >= POLL_MAX_MISSES:
+                        del misses[serial_no]
+                        return_to_discovery(name, uxr_module)
+                stats["cycles"] += 1
+                stats["reads"] += len(requests)
+                stats["timeouts"] += len(timed_out)
+                stats["unsent"] += len(unsent)
+                stats["cycle_seconds"] = time.monotonic() - started
+                stats["cycle_seconds_total"] += stats["cycle_seconds"]
+            # Until discovery adds the first module there is nothing to wait for
+            wait = poll_schedule.time_until_next()
+            write_queue.wait(min(DISCOVERY_MIN_DELAY if wait is None else wait, SCAN_INTERVAL))
+    except Exception as e:
+        logging.error(f"Polling bus {name} stopped: {e}")
+        logging.error("Traceback: %s", traceback.format_exc())
+
+
+def aggregate_discovery():
+    """Publishes Home Assistant sensors for the group and rack aggregates."""
+    if not HA_DISCOVERY_ENABLED:
+        return
+    targets = [("group", str(group), f"UXR Group {group}") for group in GROUP_IDS]
+    targets += [("rack", name, f"UXR Rack {name}") for name in buses]
+    for kind, target, device_name in targets:
+        device = {
+            "manufacturer": "UXR",
+            "model": "ChargerModule",
+            "identifiers": [f"uxr_{kind}_{target}"],
+            "name": device_name
+        }
+        for entry in AGGREGATES:
+            discovery_payload = {
+                "name": entry.label,
+                "unique_id": f"uxr_{kind}_{target}_{entry.topic}",
+                "state_topic": f"{MQTT_BASE_TOPIC}/{kind}/{target}/{entry.topic}",
+                "device": device,
+                "device_class": entry.device_class,
+                "unit_of_measurement": entry.unit,
+            }
+            discovery_topic = f"{MQTT_HA_DISCOVERY_TOPIC}/sensor/uxr_{kind}_{target}/{entry.topic}/config"
+            client.publish(discovery_topic, json.dumps(discovery_payload), retain=True)
+
+
+def publish_aggregates():
+    """Publishes totals and extremes over the modules that replied within the last scan_interval."""
+    now = time.monotonic()
+    groups = {}
+    racks = {}
+    for uxr_module in UXR_MODULES:
+        serial_no = uxr_module['SERIAL_NR']
+        if now - last_reply.get(serial_no, float('-inf')) > SCAN_INTERVAL:
+            continue
+        values = snapshot.module(serial_no)
+        groups.setdefault(str(uxr_module['GROUP_ID']), []).append(values)
+        racks.setdefault(bus_name(uxr_module), []).append(values)
+    targets = [("group", str(group), groups.get(str(group), [])) for group in GROUP_IDS]
+    targets += [("rack", name, racks.get(name, [])) for name in buses]
+    for kind, target, modules in targets:
+        values = aggregate(modules)
+        for entry in AGGREGATES:
+            if entry.topic in values:
+                publish_state(f"{MQTT_BASE_TOPIC}/{kind}/{target}/{entry.topic}", values[entry.topic], entry.topic)
+
+
+def publish_rollups():
+    """Publishes every rollup window that has ended, as JSON on <base>/<serial>/<topic>/rollup/<seconds>."""
+    for (serial_no, topic), window, summary in rollups.take_completed():
+        client.publish(f"{MQTT_BASE_TOPIC}/{serial_no}/{topic}/rollup/{window:g}", json.dumps(summary))
+
+
+def collect_metrics():
+    """Returns metric families for metrics.render(), built from memory without touching the bus."""
+    now = time.monotonic()
+    labels_by_serial = {
+        uxr_module['SERIAL_NR']: {"serial": uxr_module['SERIAL_NR'], "bus": bus_name(uxr_module), "group": uxr_module['GROUP_ID']}
+        for uxr_module in UXR_MODULES
+    }
+    readings = {}
+    up = []
+    reply_age = []
+    for serial_no, labels in labels_by_serial.items():
+        for topic, value in snapshot.module(serial_no).items():
+            if isinstance(value, (int, float)):
+                readings.setdefault(topic, []).append((labels, value))
+        up.append((labels, now - last_reply.get(serial_no, float('-inf')) <= SCAN_INTERVAL))
+        if serial_no in last_reply:
+            reply_age.append((labels, round(now - last_reply[serial_no], 3)))
+    labels_by_topic = {entry.topic: entry.label for entry in REGISTERS if entry.label is not None}
+    families = [
+        (f"uxr_{topic}", "gauge", f"Latest {labels_by_topic.get(topic, topic)} reading", samples)
+        for topic, samples in sorted(readings.items())
+    ]
+    families += [
+        ("uxr_module_up", "gauge", "Whether the module replied within scan_interval", up),
+        ("uxr_last_reply_age_seconds", "gauge", "Seconds since the module last replied", reply_age),
+    ]
+
+    def per_bus(value):
+        return [({"bus": name}, value(name)) for name in buses]
+
+    families += [
+        ("uxr_frames_sent_total", "counter", "CAN frames sent", per_bus(lambda name: buses[name].frames_sent)),
+        ("uxr_replies_total", "counter", "Replies matched to a pending read", per_bus(lambda name: buses[name].router.replies)),
+        ("uxr_pending_reads", "gauge", "Reads waiting for a reply", per_bus(lambda name: buses[name].router.pending())),
+        ("uxr_poll_cycles_total", "counter", "Poll passes", per_bus(lambda name: poll_stats[name]["cycles"])),
+        ("uxr_poll_reads_total", "counter", "Register reads requested by the poller", per_bus(lambda name: poll_stats[name]["reads"])),
+        ("uxr_poll_timeouts_total", "counter", "Poller reads that got no reply", per_bus(lambda name: poll_stats[name]["timeouts"])),
+        ("uxr_poll_unsent_total", "counter", "Poller reads the bus refused to send", per_bus(lambda name: poll_stats[name]["unsent"])),
+        ("uxr_poll_cycle_seconds", "gauge", "Duration of the last poll pass", per_bus(lambda name: poll_stats[name]["cycle_seconds"])),
+        ("uxr_poll_cycle_seconds_total", "counter", "Total time spent in poll passes", per_bus(lambda name: poll_stats[name]["cycle_seconds_total"])),
+        ("uxr_writes_total", "counter", "Queued commands applied", per_bus(lambda name: poll_stats[name]["writes"])),
+    ]
+    return families
+
+
+# Main loop publishes status while the bus workers poll
+try:
+    for heartbeat in heartbeats.values():
+        heartbeat.start()
+    workers = [
+        threading.Thread(target=discover_bus, args=(name,), name=f"uxr-discovery-{name}", daemon=True)
+        for name in buses
+    ]
+    workers += [
+        threading.Thread(target=poll_bus, args=(name,), name=f"uxr-poll-{name}", daemon=True)
+        for name in buses
+    ]
+    for worker in workers:
+        worker.start()
+    if PUBLISH_AGGREGATES:
+        aggregate_discovery()
+    if METRICS_ENABLED:
+        logging.info(f"Serving metrics on port {METRICS_PORT}")
+        MetricsServer(METRICS_PORT, collect_metrics).start()
+    while True:
+        publish_status()
+        if PUBLISH_AGGREGATES:
+            publish_aggregates()
+        if rollups is not None:
+            publish_rollups()
+        for worker in workers:
+            if not worker.is_alive():
+                raise RuntimeError(f"{worker.name} stopped")
+        time.sleep(1)
 except Exception as e:
     logging.error(f"An error occurred: {e}")
     logging.error("Traceback: %s", traceback.format_exc())
     exit_handler()
 except KeyboardInterrupt:
     logging.error("Stopping script...")
-    exit_handler()
\ No newline at end of file
+    exit_handler()
@@ -0,0 +1,131 @@
+"""
+Benchmarks UXRChargerModule against the simulator on python-can's virtual bus.
+
+Reports frame throughput, full-snapshot latency per module count, set-point
+latency while polling is running and CPU time per frame, as JSON so results can
+be compared across versions. CPU time is for the whole process, so it includes
+the simulator answering the requests.
+
+Usage:
+    python benchmark.py --output bench.json
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import statistics
+import can
+from uxr_charger_module import UXRChargerModule
+from uxr_simulator import UXRSimulator
+from registers import POLLED_REGISTERS
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def snapshot_requests(count, group=0):
+    return [(address, group, entry.register, entry.is_float) for address in range(count) for entry in POLLED_REGISTERS]
+
+
+def bench_snapshot(count, repeats, latency, timeout):
+    """Times read_many() of every polled register on `count` modules."""
+    channel = f"bench-snapshot-{count}"
+    with UXRSimulator(channel=channel, count=count, latency=latency):
+        module = UXRChargerModule(channel=channel, interface='virtual')
+        try:
+            requests = snapshot_requests(count)
+            module.prepare_frames(requests)
+            durations = []
+            timeouts = 0
+            cpu_start = time.process_time()
+            for _ in range(repeats):
+                start = time.perf_counter()
+                _, timed_out, unsent = module.read_many(requests, timeout=timeout)
+                durations.append(time.perf_counter() - start)
+                timeouts += len(timed_out) + len(unsent)
+            cpu = time.process_time() - cpu_start
+        finally:
+            module.shutdown()
+    # Each read is one request and one reply
+    frames = 2 * len(requests) * repeats
+    return {
+        "modules": count,
+        "reads_per_snapshot": len(requests),
+        "snapshot_p50_s": statistics.median(durations),
+        "snapshot_max_s": max(durations),
+        "frames_per_s": frames / sum(durations),
+        "cpu_per_frame_us": cpu / frames * 1e6,
+        "timeouts": timeouts,
+    }
+
+
+def bench_setpoint(count, samples, latency, timeout):
+    """Times set_output_voltage() plus a read-back on one module while another thread polls the rack."""
+    channel = "bench-setpoint"
+    with UXRSimulator(channel=channel, count=count, latency=latency):
+        module = UXRChargerModule(channel=channel, interface='virtual')
+        requests = snapshot_requests(count)
+        stop = threading.Event()
+        polls = []
+
+        def poll():
+            while not stop.is_set():
+                module.read_many(requests, timeout=timeout)
+                polls.append(1)
+
+        poller = threading.Thread(target=poll, daemon=True)
+        poller.start()
+        try:
+            durations = []
+            for i in range(samples):
+                voltage = 750.0 + (i % 50)
+                start = time.perf_counter()
+                module.set_output_voltage(voltage, 0, 0)
+                module.get_module_voltage(0, 0)
+                durations.append(time.perf_counter() - start)
+        finally:
+            stop.set()
+            poller.join(timeout=timeout + 1)
+            module.shutdown()
+    return {
+        "modules": count,
+        "samples": samples,
+        "setpoint_p50_s": percentile(durations, 0.5),
+        "setpoint_p99_s": percentile(durations, 0.99),
+        "concurrent_polls": len(polls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark UXR polling against a simulated rack")
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.001, help="Simulated reply latency in seconds")
+    parser.add_argument('--timeout', type=float, default=2)
+    parser.add_argument('--output', help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "python_can": can.__version__,
+        "machine": platform.machine(),
+        "simulated_latency_s": args.latency,
+        "snapshot": [bench_snapshot(count, args.repeats, args.latency, args.timeout) for count in args.counts],
+        "setpoint": bench_setpoint(max(args.counts), args.samples, args.latency, args.timeout),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
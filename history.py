@@ -0,0 +1,230 @@
+"""
+Local time series store for polled values at full poll resolution.
+
+Every module and register gets a fixed-size ring buffer of (timestamp, value)
+samples in a memory-mapped file, so history survives restarts and appending costs
+a couple of struct writes into the page cache. Values are stored as doubles so
+32-bit integer registers such as the alarm bits round-trip exactly.
+
+Usage:
+    python history.py /data/history 12124344 module_voltage --since 600 --bucket 10
+"""
+import os
+import mmap
+import json
+import time
+import struct
+import logging
+import argparse
+import threading
+
+# magic, capacity, index of the next write, number of samples held
+HEADER = struct.Struct('<4sIII')
+# timestamp (seconds since the epoch), value
+RECORD = struct.Struct('<dd')
+MAGIC = b'UXRH'
+
+
+class RingBuffer:
+    """
+    Fixed-capacity series of (timestamp, value) samples in a memory-mapped file.
+
+    Once full, each append overwrites the oldest sample. Samples are expected in
+    time order, which lets window queries binary-search instead of scanning.
+    """
+
+    def __init__(self, path, capacity=None):
+        """Opens or creates the buffer; capacity None opens an existing file at whatever capacity it has."""
+        self.path = path
+        if capacity is None:
+            with open(path, 'rb') as file:
+                _, capacity, _, _ = HEADER.unpack(file.read(HEADER.size))
+        size = HEADER.size + capacity * RECORD.size
+        fresh = not os.path.exists(path)
+        if not fresh and os.path.getsize(path) != size:
+            logging.warning(f"Discarding history in {path} with a different capacity")
+            fresh = True
+        if fresh:
+            with open(path, 'wb') as file:
+                file.truncate(size)
+        with open(path, 'r+b') as file:
+            self.map = mmap.mmap(file.fileno(), size)
+        magic, stored_capacity, self.head, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or stored_capacity != capacity:
+            if not fresh:
+                logging.warning(f"Discarding history in {path} with an unknown layout")
+            self.head = 0
+            self.count = 0
+        self.capacity = capacity
+        self.write_header()
+
+    def write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.head, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def sample(self, index):
+        """Returns the index-th oldest sample as (timestamp, value)."""
+        slot = (self.head - self.count + index) % self.capacity
+        return RECORD.unpack_from(self.map, HEADER.size + slot * RECORD.size)
+
+    def append(self, timestamp, value):
+        RECORD.pack_into(self.map, HEADER.size + self.head * RECORD.size, timestamp, value)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.write_header()
+
+    def bisect(self, timestamp):
+        """Returns the index of the first sample at or after timestamp."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.sample(middle)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def window(self, start=None, end=None):
+        """
+        Returns the samples with start <= timestamp < end, oldest first.
+
+        Parameters:
+            start (float): Epoch seconds, None for the oldest sample held.
+            end (float): Epoch seconds, None for the newest sample held.
+
+        Returns:
+            list: (timestamp, value) tuples.
+        """
+        first = 0 if start is None else self.bisect(start)
+        last = self.count if end is None else self.bisect(end)
+        return [self.sample(index) for index in range(first, last)]
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+
+def downsample(samples, bucket):
+    """
+    Reduces samples to one (start, min, mean, max, count) row per bucket seconds.
+
+    Parameters:
+        samples (list): (timestamp, value) tuples, oldest first.
+        bucket (float): Bucket width in seconds, aligned to multiples of it since the epoch.
+
+    Returns:
+        list: (bucket start, min, mean, max, count) tuples for every bucket holding samples.
+    """
+    rows = []
+    current = None
+    for timestamp, value in samples:
+        start = timestamp - timestamp % bucket
+        if current is None or start != current[0]:
+            if current is not None:
+                rows.append((current[0], current[1], current[3] / current[4], current[2], current[4]))
+            current = [start, value, value, 0.0, 0]
+        current[1] = min(current[1], value)
+        current[2] = max(current[2], value)
+        current[3] += value
+        current[4] += 1
+    if current is not None:
+        rows.append((current[0], current[1], current[3] / current[4], current[2], current[4]))
+    return rows
+
+
+class HistoryStore:
+    """
+    Ring buffers for every module and register under one directory, created on first use.
+
+    Files are named <serial>/<topic>.ring; appends from several bus workers and
+    queries from other threads are serialised per store.
+    """
+
+    def __init__(self, directory, capacity=86400):
+        self.directory = directory
+        self.capacity = capacity
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def buffer(self, serial_no, topic, create=True):
+        key = (serial_no, topic)
+        if key not in self.buffers:
+            path = os.path.join(self.directory, serial_no, f"{topic}.ring")
+            if not create:
+                # Reading never resizes, so queries cannot discard what the poller wrote
+                if not os.path.exists(path):
+                    return None
+                self.buffers[key] = RingBuffer(path)
+                return self.buffers[key]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.buffers[key] = RingBuffer(path, self.capacity)
+        return self.buffers[key]
+
+    def append(self, serial_no, topic, value, timestamp=None):
+        with self.lock:
+            self.buffer(serial_no, topic).append(time.time() if timestamp is None else timestamp, value)
+
+    def window(self, serial_no, topic, start=None, end=None):
+        """Returns the module's samples of the register between start and end, see RingBuffer.window()."""
+        with self.lock:
+            ring = self.buffer(serial_no, topic, create=False)
+            return [] if ring is None else ring.window(start, end)
+
+    def downsample(self, serial_no, topic, bucket, start=None, end=None):
+        """Returns (start, min, mean, max, count) rows per bucket seconds, see downsample()."""
+        return downsample(self.window(serial_no, topic, start, end), bucket)
+
+    def series(self):
+        """Returns (serial number, topic) for every series on disk."""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for serial_no in sorted(os.listdir(self.directory)):
+            module_directory = os.path.join(self.directory, serial_no)
+            if not os.path.isdir(module_directory):
+                continue
+            for name in sorted(os.listdir(module_directory)):
+                if name.endswith(".ring"):
+                    found.append((serial_no, name[:-len(".ring")]))
+        return found
+
+    def flush(self):
+        with self.lock:
+            for ring in self.buffers.values():
+                ring.flush()
+
+    def close(self):
+        with self.lock:
+            for ring in self.buffers.values():
+                ring.close()
+            self.buffers.clear()
+
+
+if __name__ == "__main__":
+    # Dump a series, optionally downsampled, as JSON lines
+    parser = argparse.ArgumentParser(description="Query the UXR telemetry history")
+    parser.add_argument('directory')
+    parser.add_argument('serial', nargs='?', help="Omit to list the series on disk")
+    parser.add_argument('topic', nargs='?')
+    parser.add_argument('--since', type=float, help="Seconds back from now")
+    parser.add_argument('--bucket', type=float, help="Downsample to buckets of this many seconds")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.directory)
+    if args.serial is None or args.topic is None:
+        for serial_no, topic in store.series():
+            print(f"{serial_no} {topic}")
+    else:
+        start = time.time() - args.since if args.since else None
+        if args.bucket:
+            rows = store.downsample(args.serial, args.topic, args.bucket, start)
+        else:
+            rows = store.window(args.serial, args.topic, start)
+        for row in rows:
+            print(json.dumps(row))
+    store.close()
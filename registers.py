@@ -0,0 +1,107 @@
+"""
+Declarative UXR register map.
+
+Everything register-specific is generated from REGISTERS: the get_<name>/set_<name>
+accessors on UXRChargerModule, the polling plan, the MQTT state and command topics
+and the Home Assistant discovery payloads.
+"""
+from collections import namedtuple
+
+# Scale marker for values stored as a fraction of the module's rated output current
+RATED_CURRENT = "rated_current"
+
+# register (int): Register number in the request payload.
+# name (str): Accessor suffix, e.g. get_module_voltage().
+# topic (str): MQTT state topic, or command topic under set/ for writable registers.
+# label (str): Home Assistant entity name; None keeps the register out of MQTT.
+# is_float (bool): IEEE 754 float if True, unsigned 32-bit integer otherwise.
+# scale: Raw value = value * scale on write and value = raw / scale on read,
+#     or RATED_CURRENT for fractions of the rated current (applied by app.py).
+# unit (str), device_class (str): Home Assistant unit of measurement and device class.
+# writable (bool): Set with a 0x03 write instead of read with 0x10.
+# minimum, maximum: Valid range for writes; RATED_CURRENT for the module rating.
+# step: Home Assistant number step for writable registers.
+# poll_interval (float): Default seconds between reads, None to not poll.
+# readback (str): Name of the read-only register that reports a set-point back.
+# deadband, relative_deadband (float): Smallest change worth publishing, absolute and as a
+#     fraction of the last published value; None publishes every change.
+# max_age (float): Seconds after which an unchanged value is published again, None for
+#     the publish_max_age option.
+Register = namedtuple('Register', [
+    'register', 'name', 'topic', 'label', 'is_float', 'scale', 'unit', 'device_class',
+    'writable', 'minimum', 'maximum', 'step', 'poll_interval', 'readback',
+    'deadband', 'relative_deadband', 'max_age',
+], defaults=[True, 1, None, None, False, None, None, None, None, None, None, None, None])
+
+REGISTERS = [
+    # Measurements
+    Register(0x01, "module_voltage", "module_voltage", "Module Voltage", unit="V", device_class="voltage", poll_interval=1, deadband=0.2),
+    Register(0x02, "module_current", "module_current", "Module Current", unit="A", device_class="current", poll_interval=1, deadband=0.1),
+    Register(0x03, "module_current_limit", "current_limit", "Current Limit", scale=RATED_CURRENT, unit="A", device_class="current", poll_interval=5),
+    Register(0x04, "temperature_dc_board", "temperature_of_dc_board", "Temperature of DC Board", unit="°C", device_class="temperature", poll_interval=10, deadband=0.5),
+    Register(0x05, "input_phase_voltage", "input_phase_voltage", "Input Phase Voltage", unit="V", device_class="voltage", poll_interval=5, deadband=1),
+    Register(0x08, "pfc0_voltage", "pfc0_voltage", "PFC0 Voltage", unit="V", device_class="voltage", poll_interval=5, deadband=1),
+    Register(0x0A, "pfc1_voltage", "pfc1_voltage", "PFC1 Voltage", unit="V", device_class="voltage", poll_interval=5, deadband=1),
+    Register(0x0B, "panel_board_temperature", "panel_board_temperature", "Panel Board Temperature", unit="°C", device_class="temperature", poll_interval=10, deadband=0.5),
+    Register(0x0C, "voltage_phase_a", "voltage_phase_a", "Voltage Phase A", unit="V", device_class="voltage", poll_interval=5, deadband=1),
+    Register(0x0D, "voltage_phase_b", "voltage_phase_b", "Voltage Phase B", unit="V", device_class="voltage", poll_interval=5, deadband=1),
+    Register(0x0E, "voltage_phase_c", "voltage_phase_c", "Voltage Phase C", unit="V", device_class="voltage", poll_interval=5, deadband=1),
+    Register(0x10, "temperature_pfc_board", "temperature_of_pfc_board", "Temperature of PFC Board", unit="°C", device_class="temperature", poll_interval=10, deadband=0.5),
+    Register(0x11, "rated_output_power", "rated_power", "Rated Power", unit="W", device_class="power"),
+    Register(0x12, "rated_output_current", "rated_current", "Rated Current", unit="A", device_class="current"),
+    Register(0x40, "alarm_status_bits", "alarm_status", "Alarm Status", is_float=False, poll_interval=10),
+    Register(0x48, "input_power", "input_power", "Input Power", is_float=False, unit="W", device_class="power", poll_interval=1, deadband=5, relative_deadband=0.01),
+    Register(0x4A, "current_altitude_value", "current_altitude", "Current Altitude", is_float=False, unit="m", poll_interval=600),
+    Register(0x4B, "input_working_mode", "input_working_mode", "Input Working Mode", is_float=False, poll_interval=600),
+    Register(0x54, "serial_number_low", "serial_number_low", None, is_float=False),
+    Register(0x55, "serial_number_high", "serial_number_high", None, is_float=False),
+    Register(0x56, "dcdc_version", "dcdc_version", None, is_float=False),
+    Register(0x57, "pfc_version", "pfc_version", None, is_float=False),
+
+    # Set-points and commands
+    Register(0x17, "altitude", "altitude", "Altitude", is_float=False, unit="m", writable=True, minimum=1000, maximum=5000, step=100, readback="current_altitude_value"),
+    Register(0x1B, "output_current", "current", "Output Current", is_float=False, scale=1024, unit="A", writable=True, minimum=0, maximum=RATED_CURRENT, step=0.1),
+    Register(0x1F, "method_to_assign_address", "method_to_assign_address", None, is_float=False, writable=True),
+    Register(0x21, "output_voltage", "output_voltage", "Output Voltage", unit="V", writable=True, minimum=735, maximum=810, step=0.1),
+    Register(0x22, "current_limit", "current_limit", "Current Limit", scale=RATED_CURRENT, unit="A", writable=True, minimum=0, maximum=RATED_CURRENT, step=0.1, readback="module_current_limit"),
+    Register(0x23, "max_voltage_setpoint", "max_voltage_setpoint", None, writable=True),
+    Register(0x30, "power", "power", None, is_float=False, writable=True),
+    Register(0x31, "reset_over_voltage", "reset_over_voltage", None, is_float=False, writable=True),
+    Register(0x3E, "over_voltage_protection", "over_voltage_protection", None, is_float=False, writable=True),
+    Register(0x44, "short_circuit_reset", "short_circuit_reset", None, is_float=False, writable=True),
+    Register(0x46, "input_mode", "input_mode", None, is_float=False, writable=True),
+]
+
+REGISTERS_BY_NAME = {entry.name: entry for entry in REGISTERS}
+
+# Registers read by the app.py poller
+POLLED_REGISTERS = [entry for entry in REGISTERS if not entry.writable and entry.poll_interval is not None]
+# Read-only registers published as Home Assistant sensors
+SENSOR_REGISTERS = [entry for entry in REGISTERS if not entry.writable and entry.label is not None]
+# Set-points exposed as Home Assistant numbers under <base>/<serial>/set/<topic>
+COMMAND_REGISTERS = [entry for entry in REGISTERS if entry.writable and entry.label is not None]
+
+
+def to_raw(entry, value):
+    """Applies the register's numeric scale and type for a write."""
+    if entry.scale != RATED_CURRENT:
+        value = value * entry.scale
+    return value if entry.is_float else int(round(value))
+
+
+def from_raw(entry, value):
+    """Reverses the register's numeric scale after a read."""
+    if value is None or entry.scale in (1, RATED_CURRENT):
+        return value
+    return value / entry.scale
+
+
+def in_range(entry, value, rated_current=None):
+    """Checks a write against the register's valid range; RATED_CURRENT bounds are only checked given the rating."""
+    minimum = rated_current if entry.minimum == RATED_CURRENT else entry.minimum
+    maximum = rated_current if entry.maximum == RATED_CURRENT else entry.maximum
+    if minimum is not None and value < minimum:
+        return False
+    if maximum is not None and value > maximum:
+        return False
+    return True
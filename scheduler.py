@@ -0,0 +1,151 @@
+import time
+import heapq
+import itertools
+import threading
+import logging
+
+
+class HeartbeatScheduler:
+    """
+    Keeps the modules' communication watchdog fed with as little bus traffic as possible.
+
+    Each module gets exactly one keep-alive frame per watchdog period, and none at all
+    while regular polling or set-point frames are already reaching it within the period.
+    """
+
+    def __init__(self, module, modules, period=1.0):
+        self.module = module
+        self.modules = [(uxr_module['CANBUS_ID'], uxr_module['GROUP_ID']) for uxr_module in modules]
+        self.period = period
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def run_pending(self):
+        """
+        Sends a keep-alive to every module not contacted within the period.
+
+        Returns:
+            float: Seconds until the next module falls due.
+        """
+        now = time.monotonic()
+        next_due = self.period
+        for address, group in self.modules:
+            last = self.module.last_contact(address, group)
+            if last is None or now - last >= self.period:
+                self.module.send_keep_alive(address, group)
+                last = now
+            next_due = min(next_due, last + self.period - now)
+        return max(next_due, 0.01)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                wait = self.run_pending()
+            except Exception as e:
+                logging.error(f"Heartbeat failed: {e}")
+                wait = self.period
+            self.stop_event.wait(wait)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="uxr-heartbeat", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+
+class PollScheduler:
+    """
+    Heap-ordered timetable of register reads, each repeating at its own interval.
+
+    Entries are opaque to the scheduler (app.py uses read_many() request tuples).
+    When several entries fall due together the one with the shorter interval comes
+    first, so fast-changing values are never stuck behind near-static ones. Entries
+    may be added from another thread while the timetable is being polled.
+    """
+
+    def __init__(self):
+        # (due time, interval, sequence, entry)
+        self.heap = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def add(self, entry, interval, delay=0, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            heapq.heappush(self.heap, (now + delay, interval, next(self.counter), entry))
+
+    def remove(self, matches):
+        """Drops every entry for which matches(entry) is true."""
+        with self.lock:
+            self.heap = [item for item in self.heap if not matches(item[3])]
+            heapq.heapify(self.heap)
+
+    def entries(self):
+        """Returns every scheduled entry, in no particular order."""
+        with self.lock:
+            return [entry for _, _, _, entry in self.heap]
+
+    def pop_due(self, now=None):
+        """Returns every entry that is due, in priority order, and schedules its next read."""
+        now = time.monotonic() if now is None else now
+        due = []
+        rescheduled = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due_at, interval, _, entry = heapq.heappop(self.heap)
+                due.append(entry)
+                # Skip missed slots rather than bursting to catch up after a stall
+                next_at = due_at + interval
+                if next_at <= now:
+                    next_at = now + interval
+                rescheduled.append((next_at, interval, next(self.counter), entry))
+            for item in rescheduled:
+                heapq.heappush(self.heap, item)
+        return due
+
+    def time_until_next(self, now=None):
+        """Returns seconds until the next entry is due, or None if nothing is scheduled."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not self.heap:
+                return None
+            return max(self.heap[0][0] - now, 0)
+
+
+class WriteQueue:
+    """
+    Pending bus writes keyed by target, where a newer write replaces one still waiting.
+
+    Set-points can arrive far faster than is useful to send them, e.g. while a slider
+    is dragged; only the latest value for each key is applied, at the poll worker's
+    next slot, so commands never queue up behind each other or starve polling.
+    """
+
+    def __init__(self):
+        # key -> callable, in the order of each key's latest write, so a module command queued
+        # after a group command still overrides it and vice versa
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def put(self, key, write):
+        with self.lock:
+            if self.pending.pop(key, None) is not None:
+                logging.debug(f"Replacing pending write {key}")
+            self.pending[key] = write
+        self.ready.set()
+
+    def take(self):
+        """Returns every pending write and empties the queue."""
+        with self.lock:
+            writes = list(self.pending.values())
+            self.pending.clear()
+            self.ready.clear()
+        return writes
+
+    def wait(self, timeout):
+        """Sleeps for up to timeout seconds, returning early once a write is queued."""
+        return self.ready.wait(timeout)
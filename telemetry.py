@@ -0,0 +1,202 @@
+"""
+Processing of polled values between the bus and MQTT.
+"""
+import time
+import threading
+from collections import namedtuple
+from registers import SENSOR_REGISTERS
+
+# Readings that count towards the hottest board temperature
+TEMPERATURE_TOPICS = [entry.topic for entry in SENSOR_REGISTERS if entry.device_class == "temperature"]
+
+# topic (str): MQTT state topic under the group or rack.
+# label (str), unit (str), device_class (str): Home Assistant sensor name, unit and device class.
+# deadband (float): Smallest change worth publishing.
+Aggregate = namedtuple('Aggregate', ['topic', 'label', 'unit', 'device_class', 'deadband'])
+
+AGGREGATES = [
+    Aggregate("total_power", "Total Output Power", "W", "power", 10),
+    Aggregate("total_current", "Total Current", "A", "current", 0.1),
+    Aggregate("total_input_power", "Total Input Power", "W", "power", 10),
+    Aggregate("min_voltage", "Min Module Voltage", "V", "voltage", 0.2),
+    Aggregate("max_voltage", "Max Module Voltage", "V", "voltage", 0.2),
+    Aggregate("max_temperature", "Hottest Board Temperature", "°C", "temperature", 0.5),
+    Aggregate("modules_online", "Modules Online", None, None, None),
+]
+
+
+class ChangeFilter:
+    """
+    Suppresses publishes of values that have not meaningfully changed.
+
+    A value is published when it differs from the last published value for the same
+    key by more than the deadband, or when that last publish is older than max_age.
+    Comparing against the last published value rather than the last reading means a
+    slow drift is still published once it adds up to more than the deadband.
+    """
+
+    def __init__(self):
+        # key -> (value, monotonic time of publish)
+        self.published = {}
+        self.lock = threading.Lock()
+
+    def changed(self, previous, value, deadband=None, relative_deadband=None):
+        if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)):
+            return value != previous
+        threshold = max(deadband or 0, (relative_deadband or 0) * abs(previous))
+        if threshold == 0:
+            return value != previous
+        return abs(value - previous) > threshold
+
+    def should_publish(self, key, value, deadband=None, relative_deadband=None, max_age=None, now=None):
+        """
+        Checks a value against the last one published under the same key, recording it if it is to be published.
+
+        Parameters:
+            key: Anything hashable, e.g. the MQTT topic.
+            value: The new value.
+            deadband (float): Smallest absolute change worth publishing.
+            relative_deadband (float): Smallest change worth publishing as a fraction of the last value.
+            max_age (float): Seconds after which the value is published even if unchanged, None for never.
+
+        Returns:
+            bool: True if the value should be published.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            previous = self.published.get(key)
+            if previous is not None:
+                last_value, published_at = previous
+                expired = max_age is not None and now - published_at >= max_age
+                if not expired and not self.changed(last_value, value, deadband, relative_deadband):
+                    return False
+            self.published[key] = (value, now)
+            return True
+
+    def record(self, key, value, now=None):
+        """Notes a value published without asking should_publish(), so later values are compared against it."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.published[key] = (value, now)
+
+    def forget(self):
+        """Makes every key publish its next value, e.g. after reconnecting to the broker."""
+        with self.lock:
+            self.published.clear()
+
+
+class Snapshot:
+    """
+    The latest value of every register of every module, by serial number and state topic.
+
+    Written by the bus workers as replies arrive and read by whatever publishes the
+    values, so readers always see a consistent copy.
+    """
+
+    def __init__(self):
+        # serial number -> {topic: value}
+        self.modules = {}
+        # serial number -> wall-clock time of the last update
+        self.updated = {}
+        self.lock = threading.Lock()
+
+    def update(self, serial_no, topic, value, timestamp=None):
+        with self.lock:
+            self.modules.setdefault(serial_no, {})[topic] = value
+            self.updated[serial_no] = time.time() if timestamp is None else timestamp
+
+    def module(self, serial_no):
+        """Returns a copy of the module's latest values, empty if nothing was read yet."""
+        with self.lock:
+            return dict(self.modules.get(serial_no, {}))
+
+    def updated_at(self, serial_no):
+        with self.lock:
+            return self.updated.get(serial_no)
+
+
+def aggregate(modules):
+    """
+    Combines the latest readings of several modules into totals and extremes.
+
+    Parameters:
+        modules (list): {topic: value} dicts as returned by Snapshot.module().
+
+    Returns:
+        dict: Value by AGGREGATES topic, leaving out anything no module has reported yet.
+    """
+    voltages = [values['module_voltage'] for values in modules if 'module_voltage' in values]
+    currents = [values['module_current'] for values in modules if 'module_current' in values]
+    powers = [values['module_voltage'] * values['module_current'] for values in modules
+              if 'module_voltage' in values and 'module_current' in values]
+    input_powers = [values['input_power'] for values in modules if 'input_power' in values]
+    temperatures = [values[topic] for values in modules for topic in TEMPERATURE_TOPICS if topic in values]
+    result = {"modules_online": len(modules)}
+    if powers:
+        result["total_power"] = round(sum(powers), 1)
+    if currents:
+        result["total_current"] = round(sum(currents), 2)
+    if input_powers:
+        result["total_input_power"] = sum(input_powers)
+    if voltages:
+        result["min_voltage"] = min(voltages)
+        result["max_voltage"] = max(voltages)
+    if temperatures:
+        result["max_temperature"] = max(temperatures)
+    return result
+
+
+class Rollups:
+    """
+    Min/mean/max of every series over tumbling windows, kept incrementally as samples arrive.
+
+    Each open window holds only a running min, max, sum and count, so the cost per
+    sample is constant however fast the bus is polled. Windows are aligned to multiples
+    of their length since the epoch, e.g. one minute rollups start on the minute.
+    """
+
+    def __init__(self, windows):
+        self.windows = sorted(windows)
+        # (key, window) -> [start, min, max, sum, count, last]
+        self.open = {}
+        self.completed = []
+        self.lock = threading.Lock()
+
+    def summary(self, key, window, bucket):
+        start, minimum, maximum, total, count, last = bucket
+        return key, window, {"start": start, "min": minimum, "mean": total / count, "max": maximum, "last": last, "count": count}
+
+    def add(self, key, value, timestamp=None):
+        """Adds a sample of the series identified by key to every window."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            for window in self.windows:
+                start = timestamp - timestamp % window
+                bucket = self.open.get((key, window))
+                if bucket is not None and start > bucket[0]:
+                    self.completed.append(self.summary(key, window, bucket))
+                    bucket = None
+                if bucket is None:
+                    self.open[(key, window)] = [start, value, value, value, 1, value]
+                    continue
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += value
+                bucket[4] += 1
+                bucket[5] = value
+
+    def take_completed(self, now=None):
+        """
+        Closes the windows that have ended and returns every rollup completed since the last call.
+
+        Returns:
+            list: (key, window, summary) with summary holding start, min, mean, max, last and count.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            for (key, window), bucket in list(self.open.items()):
+                if now >= bucket[0] + window:
+                    self.completed.append(self.summary(key, window, bucket))
+                    del self.open[(key, window)]
+            completed, self.completed = self.completed, []
+        return completed
@@ -0,0 +1,60 @@
+import os
+from history import RingBuffer, HistoryStore, downsample
+
+
+def test_ring_buffer_overwrites_the_oldest_samples(tmp_path):
+    ring = RingBuffer(str(tmp_path / "voltage.ring"), capacity=4)
+    for timestamp in range(6):
+        ring.append(timestamp, 770.0 + timestamp)
+    assert len(ring) == 4
+    assert ring.window() == [(2.0, 772.0), (3.0, 773.0), (4.0, 774.0), (5.0, 775.0)]
+    assert ring.window(3, 5) == [(3.0, 773.0), (4.0, 774.0)]
+    ring.close()
+
+
+def test_ring_buffer_reopens_with_its_samples(tmp_path):
+    path = str(tmp_path / "voltage.ring")
+    ring = RingBuffer(path, capacity=3)
+    for timestamp in range(5):
+        ring.append(timestamp, float(timestamp))
+    ring.close()
+    # Capacity None opens the file at whatever capacity it was created with
+    ring = RingBuffer(path)
+    assert ring.capacity == 3
+    assert ring.window() == [(2.0, 2.0), (3.0, 3.0), (4.0, 4.0)]
+    ring.append(5, 5.0)
+    assert ring.window() == [(3.0, 3.0), (4.0, 4.0), (5.0, 5.0)]
+    ring.close()
+
+
+def test_ring_buffer_with_a_new_capacity_starts_empty(tmp_path):
+    path = str(tmp_path / "voltage.ring")
+    ring = RingBuffer(path, capacity=3)
+    ring.append(0, 1.0)
+    ring.close()
+    ring = RingBuffer(path, capacity=5)
+    assert len(ring) == 0
+    ring.close()
+
+
+def test_alarm_bits_round_trip_exactly(tmp_path):
+    ring = RingBuffer(str(tmp_path / "alarm.ring"), capacity=2)
+    ring.append(0, 0xFFFFFFFF)
+    assert int(ring.window()[0][1]) == 0xFFFFFFFF
+    ring.close()
+
+
+def test_history_store_queries_do_not_create_files(tmp_path):
+    store = HistoryStore(str(tmp_path), capacity=10)
+    assert store.window("12345", "module_voltage") == []
+    store.append("12345", "module_voltage", 775.0, timestamp=100)
+    store.append("12345", "module_voltage", 776.0, timestamp=101)
+    assert store.series() == [("12345", "module_voltage")]
+    assert store.window("12345", "module_voltage", start=101) == [(101.0, 776.0)]
+    store.close()
+    assert os.listdir(str(tmp_path)) == ["12345"]
+
+
+def test_downsample_buckets_min_mean_max():
+    samples = [(0, 1.0), (5, 3.0), (10, 4.0), (19, 6.0)]
+    assert downsample(samples, 10) == [(0, 1.0, 2.0, 3.0, 2), (10, 4.0, 5.0, 6.0, 2)]
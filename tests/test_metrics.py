@@ -0,0 +1,32 @@
+from metrics import render, format_value
+
+
+def test_render_text_format():
+    families = [
+        ("uxr_module_voltage_volts", "gauge", "Output voltage.", [({"serial": "1001", "bus": "default"}, 775.0)]),
+        ("uxr_poll_cycles_total", "counter", "Poll passes.", [({}, 12)]),
+    ]
+    assert render(families) == (
+        "# HELP uxr_module_voltage_volts Output voltage.\n"
+        "# TYPE uxr_module_voltage_volts gauge\n"
+        'uxr_module_voltage_volts{serial="1001",bus="default"} 775.0\n'
+        "# HELP uxr_poll_cycles_total Poll passes.\n"
+        "# TYPE uxr_poll_cycles_total counter\n"
+        "uxr_poll_cycles_total 12\n"
+    )
+
+
+def test_render_escapes_label_values():
+    families = [("uxr_up", "gauge", "Up.", [({"bus": 'rack "A"\\1\nB'}, True)])]
+    assert 'uxr_up{bus="rack \\"A\\"\\\\1\\nB"} 1\n' in render(families)
+
+
+def test_render_leaves_out_families_without_samples():
+    families = [("uxr_empty", "gauge", "Nothing yet.", []), ("uxr_up", "gauge", "Up.", [({}, False)])]
+    assert render(families) == "# HELP uxr_up Up.\n# TYPE uxr_up gauge\nuxr_up 0\n"
+
+
+def test_format_value_infinities():
+    assert format_value(float("inf")) == "+Inf"
+    assert format_value(float("-inf")) == "-Inf"
+    assert format_value(0.5) == "0.5"
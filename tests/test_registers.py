@@ -0,0 +1,34 @@
+from registers import REGISTERS_BY_NAME, to_raw, from_raw, in_range
+
+
+def test_scaled_register_round_trips():
+    output_current = REGISTERS_BY_NAME['output_current']
+    assert to_raw(output_current, 12.5) == 12800
+    assert from_raw(output_current, 12800) == 12.5
+
+
+def test_integer_registers_are_rounded_on_write():
+    altitude = REGISTERS_BY_NAME['altitude']
+    assert to_raw(altitude, 1499.6) == 1500
+
+
+def test_rated_current_values_pass_through_unscaled():
+    current_limit = REGISTERS_BY_NAME['current_limit']
+    assert to_raw(current_limit, 0.5) == 0.5
+    assert from_raw(REGISTERS_BY_NAME['module_current_limit'], 0.5) == 0.5
+    assert from_raw(current_limit, None) is None
+
+
+def test_in_range_checks_fixed_bounds():
+    output_voltage = REGISTERS_BY_NAME['output_voltage']
+    assert in_range(output_voltage, 775)
+    assert not in_range(output_voltage, 700)
+    assert not in_range(output_voltage, 820)
+
+
+def test_in_range_checks_rated_current_bounds_only_given_the_rating():
+    output_current = REGISTERS_BY_NAME['output_current']
+    assert in_range(output_current, 1000)
+    assert in_range(output_current, 40, rated_current=40)
+    assert not in_range(output_current, 1000, rated_current=40)
+    assert not in_range(output_current, -1, rated_current=40)
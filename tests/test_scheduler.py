@@ -0,0 +1,97 @@
+import time
+from scheduler import HeartbeatScheduler, PollScheduler, WriteQueue
+from uxr_charger_module import UXRChargerModule
+
+
+def test_due_entries_come_out_shortest_interval_first():
+    schedule = PollScheduler()
+    schedule.add("altitude", 600, now=0)
+    schedule.add("temperature", 10, now=0)
+    schedule.add("voltage", 1, now=0)
+    assert schedule.pop_due(now=0) == ["voltage", "temperature", "altitude"]
+    assert schedule.pop_due(now=0.5) == []
+
+
+def test_entries_repeat_at_their_own_interval():
+    schedule = PollScheduler()
+    schedule.add("voltage", 1, now=0)
+    schedule.add("temperature", 10, now=0)
+    assert schedule.pop_due(now=0) == ["voltage", "temperature"]
+    assert schedule.pop_due(now=1) == ["voltage"]
+    assert schedule.time_until_next(now=1) == 1
+    for now in range(2, 10):
+        assert schedule.pop_due(now=now) == ["voltage"]
+    assert schedule.pop_due(now=10) == ["voltage", "temperature"]
+
+
+def test_missed_slots_are_skipped_rather_than_burst():
+    schedule = PollScheduler()
+    schedule.add("voltage", 1, now=0)
+    assert schedule.pop_due(now=0) == ["voltage"]
+    assert schedule.pop_due(now=5.5) == ["voltage"]
+    assert schedule.pop_due(now=6) == []
+    assert schedule.time_until_next(now=6) == 0.5
+
+
+def test_remove_drops_matching_entries():
+    schedule = PollScheduler()
+    for address in (1, 2):
+        for register in (0x01, 0x02):
+            schedule.add((address, 0, register, True), 1, now=0)
+    schedule.remove(lambda request: request[:2] == (1, 0))
+    assert sorted(schedule.entries()) == [(2, 0, 0x01, True), (2, 0, 0x02, True)]
+    assert schedule.pop_due(now=0) == [(2, 0, 0x01, True), (2, 0, 0x02, True)]
+
+
+def test_write_queue_keeps_only_the_latest_write_per_key():
+    queue = WriteQueue()
+    for voltage in range(750, 800):
+        queue.put(("12345", "output_voltage"), voltage)
+    queue.put(("12345", "current_limit"), 30)
+    assert queue.take() == [799, 30]
+    assert queue.take() == []
+
+
+def test_write_queue_applies_in_order_of_latest_arrival():
+    queue = WriteQueue()
+    queue.put(("12345", "output_voltage"), 760)
+    queue.put(("group", 0, "output_voltage"), 780)
+    queue.put(("12345", "output_voltage"), 765)
+    assert queue.take() == [780, 765]
+
+
+def test_write_queue_wakes_the_worker():
+    queue = WriteQueue()
+    assert not queue.wait(0)
+    queue.put("power", 1)
+    assert queue.wait(0)
+    queue.take()
+    assert not queue.wait(0)
+
+
+def test_heartbeat_skips_modules_reached_by_polls_or_broadcasts():
+    module = UXRChargerModule(channel="test-heartbeat", interface='virtual')
+    sent = []
+    send_keep_alive = module.send_keep_alive
+
+    def record(address, group):
+        sent.append((address, group))
+        send_keep_alive(address, group)
+
+    module.send_keep_alive = record
+    modules = [{"CANBUS_ID": 1, "GROUP_ID": 0}, {"CANBUS_ID": 2, "GROUP_ID": 0}, {"CANBUS_ID": 3, "GROUP_ID": 1}]
+    heartbeat = HeartbeatScheduler(module, modules, period=0.2)
+    try:
+        heartbeat.run_pending()
+        assert sorted(sent) == [(1, 0), (2, 0), (3, 1)]
+        sent.clear()
+        heartbeat.run_pending()
+        assert sent == []
+        time.sleep(0.25)
+        # A poll reaches module 1 and a broadcast reaches every module in group 1
+        module.cancel(module.start_read(0x01, 1, 0))
+        module.set_group_output_voltage(775, 1)
+        heartbeat.run_pending()
+        assert sent == [(2, 0)]
+    finally:
+        module.shutdown()
@@ -0,0 +1,82 @@
+from telemetry import ChangeFilter, Rollups, aggregate
+
+
+def test_change_filter_holds_back_changes_within_the_deadband():
+    publish_filter = ChangeFilter()
+    assert publish_filter.should_publish("voltage", 775.0, deadband=0.2, now=0)
+    assert not publish_filter.should_publish("voltage", 775.1, deadband=0.2, now=1)
+    assert not publish_filter.should_publish("voltage", 775.15, deadband=0.2, now=2)
+    # The drift adds up against the last published value, not the last reading
+    assert publish_filter.should_publish("voltage", 775.3, deadband=0.2, now=3)
+
+
+def test_change_filter_relative_deadband_scales_with_the_value():
+    publish_filter = ChangeFilter()
+    assert publish_filter.should_publish("power", 10000, deadband=5, relative_deadband=0.01, now=0)
+    assert not publish_filter.should_publish("power", 10090, deadband=5, relative_deadband=0.01, now=1)
+    assert publish_filter.should_publish("power", 10110, deadband=5, relative_deadband=0.01, now=2)
+
+
+def test_change_filter_without_deadband_publishes_every_change():
+    publish_filter = ChangeFilter()
+    assert publish_filter.should_publish("availability", "online", now=0)
+    assert not publish_filter.should_publish("availability", "online", now=1)
+    assert publish_filter.should_publish("availability", "offline", now=2)
+
+
+def test_change_filter_republishes_after_max_age():
+    publish_filter = ChangeFilter()
+    assert publish_filter.should_publish("voltage", 775.0, deadband=0.2, max_age=300, now=0)
+    assert not publish_filter.should_publish("voltage", 775.0, deadband=0.2, max_age=300, now=299)
+    assert publish_filter.should_publish("voltage", 775.0, deadband=0.2, max_age=300, now=300)
+    assert not publish_filter.should_publish("voltage", 775.0, deadband=0.2, max_age=300, now=301)
+
+
+def test_change_filter_compares_against_recorded_values():
+    publish_filter = ChangeFilter()
+    assert publish_filter.should_publish("availability", "offline", now=0)
+    publish_filter.record("availability", "online", now=1)
+    assert publish_filter.should_publish("availability", "offline", now=2)
+    publish_filter.record("power", 1, now=0)
+    assert not publish_filter.should_publish("power", 1, now=1)
+
+
+def test_change_filter_forget_publishes_everything_again():
+    publish_filter = ChangeFilter()
+    publish_filter.should_publish("voltage", 775.0, now=0)
+    publish_filter.forget()
+    assert publish_filter.should_publish("voltage", 775.0, now=1)
+
+
+def test_rollup_window_closes_once_it_has_ended():
+    rollups = Rollups([60])
+    for timestamp, value in ((120, 10.0), (150, 30.0), (179, 20.0)):
+        rollups.add("voltage", value, timestamp)
+    assert rollups.take_completed(now=179.9) == []
+    assert rollups.take_completed(now=180) == [
+        ("voltage", 60, {"start": 120, "min": 10.0, "mean": 20.0, "max": 30.0, "last": 20.0, "count": 3}),
+    ]
+    assert rollups.take_completed(now=240) == []
+
+
+def test_rollup_sample_in_a_later_window_closes_the_open_one():
+    rollups = Rollups([10, 60])
+    rollups.add("current", 1.0, 5)
+    rollups.add("current", 3.0, 15)
+    assert rollups.take_completed(now=15) == [
+        ("current", 10, {"start": 0, "min": 1.0, "mean": 1.0, "max": 1.0, "last": 1.0, "count": 1}),
+    ]
+    completed = rollups.take_completed(now=60)
+    assert ("current", 60, {"start": 0, "min": 1.0, "mean": 2.0, "max": 3.0, "last": 3.0, "count": 2}) in completed
+
+
+def test_aggregate_totals_and_extremes():
+    modules = [
+        {"module_voltage": 775.0, "module_current": 10.0, "power": 1},
+        {"module_voltage": 770.0, "module_current": 12.0, "power": 1},
+    ]
+    values = aggregate(modules)
+    assert values["total_current"] == 22.0
+    assert values["min_voltage"] == 770.0
+    assert values["max_voltage"] == 775.0
+    assert values["modules_online"] == 2
@@ -0,0 +1,212 @@
+import time
+import errno
+import asyncio
+import itertools
+from collections import deque
+import can
+import pytest
+from uxr_charger_module import UXRChargerModule, AsyncUXRChargerModule, UXRProtocol, ResponseRouter, ReadTransaction
+from uxr_simulator import UXRSimulator, SimulatedModule
+
+channels = itertools.count()
+
+
+@pytest.fixture
+def rack(request):
+    """Yields (simulator, module) on a fresh virtual bus; parametrise with UXRSimulator keyword arguments."""
+    options = dict(getattr(request, "param", {}))
+    channel = f"test-rack-{next(channels)}"
+    with UXRSimulator(channel=channel, seed=1, **options) as simulator:
+        module = UXRChargerModule(channel=channel, interface='virtual')
+        yield simulator, module
+        module.shutdown()
+
+
+@pytest.mark.parametrize("rack", [{"count": 4, "latency": 0.005, "jitter": 0.004}], indirect=True)
+def test_read_many_matches_replies_arriving_out_of_order(rack):
+    simulator, module = rack
+    requests = [(address, 0, register, False) for address in range(4) for register in (0x54, 0x55)]
+    results, timed_out, unsent = module.read_many(requests, timeout=1)
+    assert timed_out == unsent == []
+    for address in range(4):
+        assert results[(address, 0, 0x54)] == (10000 + address) & 0xFFFF
+        assert results[(address, 0, 0x55)] == (10000 + address) >> 16
+    assert module.router.pending() == 0
+
+
+@pytest.mark.parametrize("rack", [{"count": 1, "latency": 0.2}], indirect=True)
+def test_late_reply_to_a_cancelled_read_is_discarded(rack):
+    simulator, module = rack
+    _, timed_out, _ = module.read_many([(0, 0, 0x01, True)], timeout=0.05)
+    assert timed_out == [(0, 0, 0x01)]
+    assert module.router.pending() == 0
+    simulator.modules[(0, 0)].write(0x21, 760.0)
+    # Replies carry no sequence number, so only a reply arriving with no read waiting can be told apart
+    time.sleep(0.3)
+    assert simulator.replies_sent == 1
+    assert module.read_many([(0, 0, 0x01, True)], timeout=1) == ({(0, 0, 0x01): 760.0}, [], [])
+
+
+@pytest.mark.parametrize("rack", [{"count": 2}], indirect=True)
+def test_read_many_reports_silent_modules_as_timed_out(rack):
+    _, module = rack
+    results, timed_out, _ = module.read_many([(0, 0, 0x01, True), (7, 0, 0x01, True)], timeout=0.2)
+    assert results == {(0, 0, 0x01): 775.0}
+    assert timed_out == [(7, 0, 0x01)]
+    assert module.router.pending() == 0
+
+
+def emulate_transmit_queue(module, depth=10, frame_time=0.001):
+    """Makes module.bus.send refuse frames like a SocketCAN transmit queue of `depth` frames draining one per frame_time."""
+    send = module.bus.send
+    queued = deque()
+
+    def send_queued(message, timeout=None):
+        now = time.monotonic()
+        while queued and queued[0] <= now:
+            queued.popleft()
+        if len(queued) >= depth:
+            raise can.CanOperationError("No buffer space available", error_code=errno.ENOBUFS)
+        queued.append(max([now] + list(queued)[-1:]) + frame_time)
+        send(message, timeout)
+
+    module.bus.send = send_queued
+
+
+@pytest.mark.parametrize("rack", [{"count": 8}], indirect=True)
+def test_read_many_stops_sending_once_a_send_keeps_failing(rack):
+    _, module = rack
+    send = module.bus.send
+    sends = itertools.count(1)
+
+    def refuse_from_fourth(message, timeout=None):
+        if next(sends) >= 4:
+            raise can.CanOperationError("Adapter gone")
+        send(message, timeout)
+
+    module.bus.send = refuse_from_fourth
+    results, timed_out, unsent = module.read_many([(address, 0, 0x01, True) for address in range(8)], timeout=0.5)
+    assert timed_out == []
+    assert unsent == [(address, 0, 0x01) for address in range(3, 8)]
+    assert len(results) == 3
+    assert module.router.pending() == 0
+
+
+@pytest.mark.parametrize("rack", [{"count": 4}], indirect=True)
+def test_read_many_waits_for_room_in_a_full_transmit_queue(rack):
+    _, module = rack
+    emulate_transmit_queue(module)
+    requests = [(address, 0, entry, True) for address in range(4) for entry in (0x01, 0x02, 0x04, 0x05, 0x08)]
+    results, timed_out, unsent = module.read_many(requests, timeout=1)
+    assert timed_out == unsent == []
+    assert len(results) == 20
+
+
+@pytest.mark.parametrize("rack", [{"modules": [SimulatedModule(1, 2, 123456), SimulatedModule(4, 5, 654321)]}], indirect=True)
+def test_scan_finds_modules_in_every_group(rack):
+    _, module = rack
+    assert module.scan(groups=range(8), addresses=range(8), timeout=0.1) == ({(1, 2): 123456, (4, 5): 654321}, [])
+
+
+@pytest.mark.parametrize("rack", [{"count": 4}], indirect=True)
+def test_scan_waits_for_room_in_a_full_transmit_queue(rack):
+    _, module = rack
+    emulate_transmit_queue(module)
+    found, unsent = module.scan(groups=[0])
+    assert found == {(address, 0): 10000 + address for address in range(4)}
+    assert unsent == []
+
+
+@pytest.mark.parametrize("rack", [{"count": 4, "latency": 0.005, "jitter": 0.004}], indirect=True)
+def test_async_reads_gathered_across_modules(rack):
+    simulator, _ = rack
+
+    async def read_all():
+        async with AsyncUXRChargerModule(channel=simulator.channel, interface='virtual') as module:
+            serial_numbers = await asyncio.gather(*(module.get_serial_number(address, 0) for address in range(4)))
+            return serial_numbers, module.waiting
+
+    serial_numbers, waiting = asyncio.run(read_all())
+    assert serial_numbers == [10000 + address for address in range(4)]
+    assert waiting == {}
+
+
+@pytest.mark.parametrize("rack", [{"count": 1}], indirect=True)
+def test_async_read_of_a_silent_module_times_out(rack):
+    simulator, _ = rack
+
+    async def read_silent():
+        async with AsyncUXRChargerModule(channel=simulator.channel, interface='virtual') as module:
+            voltages = await asyncio.gather(module.read_value(0x01, 0, 0, timeout=1), module.read_value(0x01, 7, 0, timeout=0.1))
+            return voltages, module.waiting
+
+    voltages, waiting = asyncio.run(read_silent())
+    assert voltages == [775.0, None]
+    assert waiting == {}
+
+
+@pytest.mark.parametrize("rack", [{"count": 1}], indirect=True)
+def test_async_read_survives_a_refused_send(rack):
+    simulator, _ = rack
+
+    async def read_after_refusal():
+        async with AsyncUXRChargerModule(channel=simulator.channel, interface='virtual') as module:
+            send = module.bus.send
+
+            def refuse(message, timeout=None):
+                raise can.CanOperationError("No buffer space available")
+
+            module.bus.send = refuse
+            with pytest.raises(can.CanError):
+                await module.read_value(0x01, 0, 0)
+            assert module.waiting == {}
+            module.bus.send = send
+            return await module.read_value(0x01, 0, 0, timeout=1)
+
+    assert asyncio.run(read_after_refusal()) == 775.0
+
+
+@pytest.mark.parametrize("rack", [{"modules": [SimulatedModule(1, 1, 1001), SimulatedModule(2, 1, 1002), SimulatedModule(1, 2, 2001)]}], indirect=True)
+def test_group_broadcast_reaches_only_its_group(rack):
+    simulator, module = rack
+    send = module.bus.send
+    sent = []
+
+    def count(message, timeout=None):
+        sent.append(message)
+        send(message, timeout)
+
+    module.bus.send = count
+    module.set_group_output_voltage(760.0, 1)
+    module.group_power_on_off(0x00010000, 1)
+    assert len(sent) == 2
+    time.sleep(0.1)
+    assert [simulator.modules[key].values[0x21] for key in ((1, 1), (2, 1))] == [760.0, 760.0]
+    assert [simulator.modules[key].values[0x30] for key in ((1, 1), (2, 1))] == [0x00010000, 0x00010000]
+    assert 0x21 not in simulator.modules[(1, 2)].values
+    assert 0x30 not in simulator.modules[(1, 2)].values
+    assert simulator.replies_sent == 0
+
+
+def test_router_completes_oldest_read_of_a_register_first():
+    protocol = UXRProtocol()
+    router = ResponseRouter(protocol)
+    first = ReadTransaction(0x01, 3, 0)
+    second = ReadTransaction(0x01, 3, 0)
+    router.add(first)
+    router.add(second)
+    arbitration_id = protocol.generate_can_arbitration_id(0x060, 1, 0xF0, 3, 0)
+    reply = can.Message(arbitration_id=arbitration_id, data=[0x41, 0, 0, 0x01, 0x44, 0x41, 0xC0, 0x00], is_extended_id=True)
+    assert router.dispatch(reply) is first
+    assert first.done and not second.done
+    assert router.pending() == 1
+    router.remove(second)
+    assert router.dispatch(reply) is None
+
+
+def test_simulator_seed_makes_readings_reproducible():
+    readings = []
+    for _ in range(2):
+        simulator = UXRSimulator(count=1, seed=7)
+        readings.append([simulator.modules[(0, 0)].read(0x02) for _ in range(5)])
+    assert readings[0] == readings[1]
@@ -1,20 +1,157 @@
 import struct
 import can
 import time
+import threading
+import logging
+import asyncio
+from collections import deque
+from registers import REGISTERS, to_raw, from_raw, in_range
+
+# A refused send, e.g. ENOBUFS from a full SocketCAN transmit queue, is retried with backoff
+# from the first to the last delay until the queue drains at the bus rate or the timeout ends
+SEND_RETRY_MIN_DELAY = 0.001
+SEND_RETRY_MAX_DELAY = 0.02
+SEND_RETRY_TIMEOUT = 0.1
+# Bits on the wire per request and reply, extended 8-byte frames with worst-case bit stuffing
+FRAME_PAIR_BITS = 2 * 160
+
+# Alarm/status register (0x40) bit descriptions, from Table-2
+ALARM_STATUS_BITS = {
+    0: "Module fault (red light)",
+    1: "Module protection (yellow light)",
+    2: "Reserved",
+    3: "Inside SCI communication error",
+    4: "Input mode detection error (or input wiring error)",
+    5: "Input mode mismatch",
+    6: "Reserved",
+    7: "DCDC overvoltage",
+    8: "PFC voltage exception (unbalanced, overvoltage, or undervoltage)",
+    9: "AC overvoltage",
+    10: "Reserved",
+    11: "Reserved",
+    12: "Reserved",
+    13: "Reserved",
+    14: "AC undervoltage",
+    15: "Reserved",
+    16: "CAN communication error",
+    17: "Unbalanced current",
+    18: "Reserved",
+    19: "Reserved",
+    20: "Reserved",
+    21: "Reserved",
+    22: "DCDC status of power (0: power on, 1: power off)",
+    23: "Module limit power",
+    24: "Temperature limit power",
+    25: "AC limit power",
+    26: "Reserved",
+    27: "Fans fault",
+    28: "DCDC short-circuit",
+    29: "Reserved",
+    30: "DCDC overtemperature",
+    31: "DCDC output overvoltage"
+}
+
+
+class ReadTransaction:
+    """A read request that has been sent and is waiting for its response frame."""
+
+    def __init__(self, register, address, group, is_float=True):
+        self.register = register
+        self.address = address
+        self.group = group
+        self.is_float = is_float
+        self.response = None
+        self.completed = threading.Event()
+
+    @property
+    def key(self):
+        return (self.address, self.group, self.register)
+
+    @property
+    def done(self):
+        return self.completed.is_set()
+
+    def complete(self, response):
+        self.response = response
+        self.completed.set()
+
+
+class ResponseRouter(can.Listener):
+    """
+    Demultiplexes reply frames into per-module, per-register queues of pending reads.
+
+    Runs on the can.Notifier thread, so any number of caller threads can have reads
+    outstanding on the same bus without serialising on a shared lock.
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        # (address, group) -> {register: deque of ReadTransaction, oldest first}
+        self.modules = {}
+        self.lock = threading.Lock()
+        # Replies matched to a pending read
+        self.replies = 0
+
+    def add(self, transaction):
+        with self.lock:
+            registers = self.modules.setdefault((transaction.address, transaction.group), {})
+            registers.setdefault(transaction.register, deque()).append(transaction)
+
+    def remove(self, transaction):
+        with self.lock:
+            registers = self.modules.get((transaction.address, transaction.group))
+            if registers is None:
+                return
+            waiting = registers.get(transaction.register)
+            if waiting and transaction in waiting:
+                waiting.remove(transaction)
+                if not waiting:
+                    del registers[transaction.register]
+
+    def pending(self):
+        """Returns the number of reads still waiting for a reply."""
+        with self.lock:
+            return sum(len(waiting) for registers in self.modules.values() for waiting in registers.values())
+
+    def dispatch(self, message):
+        """
+        Matches a received frame to the oldest pending read it answers.
 
-class UXRChargerModule:
+        Returns:
+            ReadTransaction: The completed read, or None if the frame is not a reply to us.
+        """
+        key = self.protocol.reply_key(message)
+        if key is None:
+            return None
+        address, group, register = key
+        with self.lock:
+            registers = self.modules.get((address, group))
+            if not registers:
+                return None
+            waiting = registers.get(register)
+            if not waiting:
+                return None
+            transaction = waiting.popleft()
+            if not waiting:
+                del registers[register]
+            self.replies += 1
+        transaction.complete(bytes(message.data))
+        return transaction
+
+    def on_message_received(self, msg):
+        if self.dispatch(msg) is None:
+            logging.debug(f"Discarding unsolicited frame 0x{msg.arbitration_id:08X}")
+
+    def on_error(self, exc):
+        logging.error(f"CAN receive error: {exc}")
+
+
+class UXRProtocol:
+    """Frame encoding and decoding shared by the blocking and asyncio clients."""
     source_address = 0xF0
     protno = 0x060
-
-    def __init__(self, channel, bitrate=125000):
-        self.bus = can.interface.Bus(channel=channel, interface='slcan', bitrate=bitrate)
-
-    def flush_buffer(self):
-        """Flush any existing messages in the CAN buffer."""
-        while True:
-            message = self.bus.recv(timeout=0.1)
-            if message is None:
-                break
+    # Destination address used with PTP=0 to reach every module in a group
+    broadcast_address = 0xFF
 
     def generate_can_arbitration_id(self, protno=0x060, ptp=1, dstaddr=0x00, srcaddr=0x00, group=0):
         if not (0 <= protno <= 0x1FF):
@@ -31,16 +168,54 @@ class UXRChargerModule:
         arbitration_id = (protno << 20) | (ptp << 19) | (dstaddr << 11) | (srcaddr << 3) | group
         return arbitration_id
 
-    def send_frame(self, arbitration_id, data):
-        self.flush_buffer()
-        frame = can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=True)
-        self.bus.send(frame)
+    @classmethod
+    def protocol_filters(cls):
+        """Returns python-can receive filters that accept only extended frames with the UXR protocol number."""
+        return [{"can_id": cls.protno << 20, "can_mask": 0x1FF << 20, "extended": True}]
+
+    def decode_can_arbitration_id(self, arbitration_id):
+        """Split an arbitration ID into (protno, ptp, dstaddr, srcaddr, group)."""
+        protno = (arbitration_id >> 20) & 0x1FF
+        ptp = (arbitration_id >> 19) & 0x1
+        dstaddr = (arbitration_id >> 11) & 0xFF
+        srcaddr = (arbitration_id >> 3) & 0xFF
+        group = arbitration_id & 0x7
+        return protno, ptp, dstaddr, srcaddr, group
+
+    def reply_key(self, message):
+        """
+        Identifies which read a frame answers.
+
+        Returns:
+            tuple: (address, group, register) of a reply addressed to us, or None for any other frame.
+        """
+        data = message.data
+        if len(data) < 8 or data[0] not in (0x41, 0x42):
+            return None
+        protno, _, dstaddr, srcaddr, group = self.decode_can_arbitration_id(message.arbitration_id)
+        if protno != self.protno or dstaddr != self.source_address:
+            return None
+        return srcaddr, group, data[3]
+
+    def read_request(self, register):
+        return [0x10, 0x00, 0x00, register, 0x00, 0x00, 0x00, 0x00]
 
-    def receive_frame(self):
-        message = self.bus.recv(timeout=2)
-        if message:
-            return message.arbitration_id, message.data
-        return None, None
+    def write_request(self, register, value, is_float=True):
+        if is_float:
+            # Convert the float value to 4 bytes using IEEE 754 format
+            value_bytes = list(self.float_to_bytes(value))
+        else:
+            # Convert the integer value to 4 bytes
+            value_bytes = list(value.to_bytes(4, byteorder='big'))
+        return [0x03, 0x00, 0x00, register] + value_bytes
+
+    def decode_alarm_status(self, status):
+        """Returns the active alarms in an alarm/status register value as {bit: description}."""
+        active_alarms = {}
+        for bit, description in ALARM_STATUS_BITS.items():
+            if status & (1 << bit):
+                active_alarms[bit] = description
+        return active_alarms
 
     def float_to_bytes(self, value):
         return struct.pack('>f', value)
@@ -48,134 +223,285 @@ class UXRChargerModule:
     def bytes_to_float(self, value_bytes):
         return struct.unpack('>f', value_bytes)[0]
 
-    def read_value(self, register, address, group, is_float=True):
-        data = [0x10, 0x00, 0x00, register, 0x00, 0x00, 0x00, 0x00]
-        arbitration_id = self.generate_can_arbitration_id(self.protno, 1, address, self.source_address, group)
-        self.send_frame(arbitration_id, data)
-        _, response_data = self.receive_frame()
+    def parse_response(self, response_data, is_float=True):
         if response_data and response_data[0] == 0x41 and is_float == True:
             return round(self.bytes_to_float(response_data[4:8]), 2)
         elif response_data and response_data[0] == 0x42 and is_float == False:
             return struct.unpack('>I', response_data[4:8])[0]
         return None
 
-    def set_value(self, register, value, address, group, is_float=True):
+
+class UXRChargerModule(UXRProtocol):
+
+    def __init__(self, channel, bitrate=125000, interface='slcan', can_filters=None, **bus_options):
         """
-        Sets a value on the device for the given register.
+        Opens the CAN bus.
 
         Parameters:
-            register (int): The register address to set.
-            value: The value to set (either float or integer).
-            address (int): The destination address for the CAN message.
-            group (int): The group ID for the CAN message.
-            is_float (bool): If True, the value is treated as a float. If False, as an integer.
+            channel (str): Interface channel, e.g. '/dev/ttyACM0' for slcan or 'can0' for socketcan.
+            bitrate (int): Bus bitrate.
+            interface (str): Any python-can interface name, e.g. 'slcan', 'socketcan' or 'virtual'.
+            can_filters (list): python-can receive filters, e.g. UXRProtocol.protocol_filters().
+                SocketCAN applies them in the kernel; other interfaces filter in software.
+            bus_options: Extra driver options passed to can.interface.Bus.
         """
-        if is_float:
-            # Convert the float value to 4 bytes using IEEE 754 format
-            value_bytes = list(struct.pack('>f', value))
-        else:
-            # Convert the integer value to 4 bytes
-            value_bytes = list(value.to_bytes(4, byteorder='big'))
+        self.bus = can.interface.Bus(channel=channel, interface=interface, bitrate=bitrate,
+                                     can_filters=can_filters, **bus_options)
+        self.bitrate = bitrate
+        self.send_lock = threading.Lock()
+        # Monotonic time of the last frame sent to each (address, group)
+        self.last_sent = {}
+        # Read request frames built once per (address, group, register) and reused
+        self.request_frames = {}
+        # Frames sent since the bus was opened, for monitoring
+        self.frames_sent = 0
+        # The notifier thread owns bus.recv(); callers only send and wait
+        self.router = ResponseRouter(self)
+        self.notifier = can.Notifier(self.bus, [self.router], timeout=0.1)
 
-        # Construct the data payload
-        data = [0x03, 0x00, 0x00, register] + value_bytes
-        # print(" ".join(f"0x{byte:02X}" for byte in data))
-        # Generate the CAN arbitration ID
-        arbitration_id = self.generate_can_arbitration_id(self.protno, 1, address, self.source_address, group)
-        # Send the frame
-        self.send_frame(arbitration_id, data)
-
-    # Functions to get specific values
-    def get_module_voltage(self, address, group):
-        return self.read_value(0x01, address, group)
-
-    def get_module_current(self, address, group):
-        return self.read_value(0x02, address, group)
-
-    def get_module_current_limit(self, address, group):
-        return self.read_value(0x03, address, group)
-
-    def get_temperature_dc_board(self, address, group):
-        return self.read_value(0x04, address, group)
-
-    def get_input_phase_voltage(self, address, group):
-        return self.read_value(0x05, address, group)
-
-    def get_pfc0_voltage(self, address, group):
-        return self.read_value(0x08, address, group)
-
-    def get_pfc1_voltage(self, address, group):
-        return self.read_value(0x0A, address, group)
-
-    def get_panel_board_temperature(self, address, group):
-        return self.read_value(0x0B, address, group)
+    def send_frame(self, arbitration_id, data):
+        self.send_message(can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=True))
+
+    def send_message(self, frame):
+        arbitration_id = frame.arbitration_id
+        deadline = time.monotonic() + SEND_RETRY_TIMEOUT
+        delay = SEND_RETRY_MIN_DELAY
+        with self.send_lock:
+            while True:
+                try:
+                    self.bus.send(frame)
+                    break
+                except can.CanError:
+                    if time.monotonic() + delay > deadline:
+                        raise
+                    time.sleep(delay)
+                    delay = min(delay * 2, SEND_RETRY_MAX_DELAY)
+            self.frames_sent += 1
+        self.last_sent[((arbitration_id >> 11) & 0xFF, arbitration_id & 0x7)] = time.monotonic()
+
+    def request_frame(self, register, address, group):
+        """
+        Returns the cached read request frame for a register, building it on first use.
 
-    def get_voltage_phase_a(self, address, group):
-        return self.read_value(0x0C, address, group)
+        The frame is shared between calls and must not be modified.
+        """
+        key = (address, group, register)
+        frame = self.request_frames.get(key)
+        if frame is None:
+            arbitration_id = self.generate_can_arbitration_id(self.protno, 1, address, self.source_address, group)
+            frame = can.Message(arbitration_id=arbitration_id, data=self.read_request(register), is_extended_id=True)
+            self.request_frames[key] = frame
+        return frame
+
+    def prepare_frames(self, requests):
+        """Builds the request frames for (address, group, register, is_float) tuples ahead of polling."""
+        for address, group, register, _ in requests:
+            self.request_frame(register, address, group)
+
+    def last_contact(self, address, group):
+        """Returns the monotonic time a frame was last sent to the module or its group, or None."""
+        times = [t for t in (self.last_sent.get((address, group)),
+                             self.last_sent.get((self.broadcast_address, group))) if t is not None]
+        return max(times) if times else None
+
+    def send_keep_alive(self, address, group, register=0x48):
+        """Sends a read request as a heartbeat without waiting; the reply is discarded."""
+        self.send_message(self.request_frame(register, address, group))
+
+    def start_read(self, register, address, group, is_float=True):
+        """
+        Sends a read request without waiting for the reply.
 
-    def get_voltage_phase_b(self, address, group):
-        return self.read_value(0x0D, address, group)
+        Any number of reads may be in flight at once; replies are matched back to
+        their request by source address, group and register, see ResponseRouter.
 
-    def get_voltage_phase_c(self, address, group):
-        return self.read_value(0x0E, address, group)
+        Returns:
+            ReadTransaction: The pending read, to be passed to wait_for().
+        """
+        transaction = ReadTransaction(register, address, group, is_float)
+        frame = self.request_frame(register, address, group)
+        self.router.add(transaction)
+        try:
+            self.send_message(frame)
+        except can.CanError:
+            # Nothing was sent, so no reply will ever complete the read
+            self.router.remove(transaction)
+            raise
+        return transaction
+
+    def cancel(self, transaction):
+        """Stops waiting for a read so a late reply is discarded."""
+        self.router.remove(transaction)
+
+    def wait_for(self, transactions, timeout=2):
+        """
+        Waits until every given read is answered or the timeout expires.
 
-    def get_temperature_pfc_board(self, address, group):
-        return self.read_value(0x10, address, group)
+        Reads still unanswered at the deadline are cancelled.
 
-    def get_rated_output_power(self, address, group):
-        return self.read_value(0x11, address, group)
+        Returns:
+            bool: True if all reads completed.
+        """
+        deadline = time.monotonic() + timeout
+        complete = True
+        for transaction in transactions:
+            if not transaction.completed.wait(max(deadline - time.monotonic(), 0)):
+                self.cancel(transaction)
+                # The reply may have landed between the timeout and the cancel
+                complete = complete and transaction.done
+        return complete
 
-    def get_rated_output_current(self, address, group):
-        return self.read_value(0x12, address, group)
+    def read_value(self, register, address, group, is_float=True):
+        transaction = self.start_read(register, address, group, is_float)
+        self.wait_for([transaction])
+        return self.parse_response(transaction.response, is_float)
 
-    # Functions to set values
-    def set_altitude(self, altitude, address, group):
-        if 1000 <= altitude <= 5000:
-            self.set_value(0x17, altitude, address, group, is_float=False)
+    def bus_time(self, reads):
+        """Returns the seconds that many requests and their replies take on the wire."""
+        return reads * FRAME_PAIR_BITS / self.bitrate
 
-    def set_output_current(self, current, address, group):
-        current_value = int(current * 1024)
-        self.set_value(0x1B, current_value, address, group, is_float=False)
+    def read_many(self, requests, timeout=2):
+        """
+        Reads a list of registers, possibly from many modules, in one pass.
 
-    def set_group_id(self, group_id, address):
-        if 0 <= group_id <= 7:
-            self.set_value(0x1E, group_id, address, 0, is_float=False)
+        All requests are sent back to back, each waiting for room in the transmit
+        queue as send_message() does, and the replies collected against a single
+        overall deadline rather than one round-trip at a time. Once a request cannot
+        be sent even after retrying, it and the rest are reported as unsent rather
+        than failing the whole pass.
 
-    def set_method_to_assign_address(self, method, address, group):
-        self.set_value(0x1F, method, address, group, is_float=False)
+        Parameters:
+            requests (list): (address, group, register, is_float) tuples.
+            timeout (float): Overall deadline in seconds for all replies.
 
-    def set_output_voltage(self, voltage, address, group):
-        self.set_value(0x21, voltage, address, group, is_float=True)
+        Returns:
+            tuple: (results, timed_out, unsent) where results maps (address, group, register)
+            to the decoded value, timed_out lists the keys that got no reply and unsent
+            the keys whose request never reached the bus.
+        """
+        transactions = []
+        timed_out = []
+        unsent = []
+        send_error = None
+        for address, group, register, is_float in requests:
+            if send_error is not None:
+                unsent.append((address, group, register))
+                continue
+            try:
+                transactions.append(self.start_read(register, address, group, is_float))
+            except can.CanError as e:
+                send_error = e
+                unsent.append((address, group, register))
+        if send_error is not None:
+            logging.warning(f"{len(unsent)} of {len(requests)} read requests could not be sent: {send_error}")
+        self.wait_for(transactions, timeout)
+        results = {}
+        for transaction in transactions:
+            if transaction.done:
+                results[transaction.key] = self.parse_response(transaction.response, transaction.is_float)
+            else:
+                timed_out.append(transaction.key)
+        return results, timed_out, unsent
+
+    def read_serial_numbers(self, modules, timeout=2):
+        """
+        Reads the serial numbers of many modules in one pipelined pass.
 
-    def set_current_limit(self, current_limit, address, group):
-        self.set_value(0x22, current_limit, address, group, is_float=True)
+        Parameters:
+            modules (list): (address, group) tuples.
+            timeout (float): Overall deadline in seconds for all replies.
 
-    def set_max_voltage_setpoint(self, voltage, address, group):
-        self.set_value(0x23, voltage, address, group, is_float=True)
+        Returns:
+            dict: Maps (address, group) to the serial number of every module that answered.
+        """
+        results, _, _ = self.read_many([(address, group, register, False)
+                                        for address, group in modules for register in (0x54, 0x55)], timeout)
+        serial_numbers = {}
+        for address, group in modules:
+            low_field = results.get((address, group, 0x54))
+            high_field = results.get((address, group, 0x55))
+            if low_field is not None and high_field is not None:
+                serial_numbers[(address, group)] = (high_field << 16) | low_field
+        return serial_numbers
+
+    def scan(self, groups=range(8), addresses=range(0xFF), timeout=0.5):
+        """
+        Finds the modules on the bus by reading the serial number at every address.
 
-    def power_on_off(self, state, address, group):
-        self.set_value(0x30, state, address, group, is_float=False)
+        Each group is swept with one pipelined pass over the low serial field, and only
+        the addresses that answer have the high field read, so a full sweep takes one
+        deadline per group rather than one per address. Sends are paced by the transmit
+        queue as in send_message(), and each deadline is extended by the time the pass
+        takes on the wire.
 
-    def set_reset_over_voltage(self, reset, address, group):
-        self.set_value(0x31, reset, address, group, is_float=False)
+        Parameters:
+            groups (iterable): Group IDs to sweep.
+            addresses (iterable): Addresses to sweep, 0xFF being the broadcast address.
+            timeout (float): Seconds to wait for replies beyond each pass's time on the wire.
 
-    def set_over_voltage_protection(self, enable, address, group):
-        self.set_value(0x3E, enable, address, group, is_float=False)
+        Returns:
+            tuple: (found, unsent) where found maps (address, group) to the serial number
+            of every module found and unsent lists the reads that could not be sent, so
+            a sweep with any unsent is incomplete.
+        """
+        found = {}
+        unsent = []
+        for group in groups:
+            requests = [(address, group, 0x54, False) for address in addresses]
+            results, _, not_sent = self.read_many(requests, timeout + self.bus_time(len(requests)))
+            unsent += not_sent
+            present = [(address, group) for (address, group, _), value in results.items() if value is not None]
+            if not present:
+                continue
+            requests = [(address, group, register, False) for address, group in present for register in (0x54, 0x55)]
+            results, _, not_sent = self.read_many(requests, timeout + self.bus_time(len(requests)))
+            unsent += not_sent
+            # A module that also answers outside its own group is kept once, under the first group it answered in
+            known = set(found.values())
+            for address, group in present:
+                low_field = results.get((address, group, 0x54))
+                high_field = results.get((address, group, 0x55))
+                if low_field is None or high_field is None:
+                    continue
+                serial_number = (high_field << 16) | low_field
+                if serial_number not in known:
+                    found[(address, group)] = serial_number
+        return found, unsent
+
+    def set_value(self, register, value, address, group, is_float=True, ptp=1):
+        """
+        Sets a value on the device for the given register.
 
-    def set_short_circuit_reset(self, reset, address, group):
-        self.set_value(0x44, reset, address, group, is_float=False)
+        Parameters:
+            register (int): The register address to set.
+            value: The value to set (either float or integer).
+            address (int): The destination address for the CAN message.
+            group (int): The group ID for the CAN message.
+            is_float (bool): If True, the value is treated as a float. If False, as an integer.
+            ptp (int): 1 for point-to-point, 0 to broadcast to the whole group.
+        """
+        # Construct the data payload
+        data = self.write_request(register, value, is_float)
+        # print(" ".join(f"0x{byte:02X}" for byte in data))
+        # Generate the CAN arbitration ID
+        arbitration_id = self.generate_can_arbitration_id(self.protno, ptp, address, self.source_address, group)
+        # Send the frame
+        self.send_frame(arbitration_id, data)
 
-    def set_input_mode(self, mode, address, group):
-        self.set_value(0x46, mode, address, group, is_float=False)
+    def set_group_value(self, register, value, group, is_float=True):
+        """
+        Broadcasts a value to every module in a group with a single frame (PTP=0).
 
-    def get_input_power(self, address, group):
-        return self.read_value(0x48, address, group, is_float=False)
+        All modules in the group apply the value together; no replies are expected.
+        """
+        self.set_value(register, value, self.broadcast_address, group, is_float, ptp=0)
 
-    def get_current_altitude_value(self, address, group):
-        return self.read_value(0x4A, address, group, is_float=False)
+    # get_<name>, set_<name> and set_group_<name> accessors for every register in
+    # registers.REGISTERS are generated below the class
 
-    def get_input_working_mode(self, address, group):
-        return self.read_value(0x4B, address, group, is_float=False)
+    def set_group_id(self, group_id, address):
+        if 0 <= group_id <= 7:
+            self.set_value(0x1E, group_id, address, 0, is_float=False)
 
     def get_serial_number(self, address, group):
         """
@@ -189,12 +515,12 @@ class UXRChargerModule:
             int: The full serial number, or None if either read fails.
         """
         # Read the low field of the serial number
-        low_field = self.read_value(0x54, address, group, is_float=False)
+        low_field = self.get_serial_number_low(address, group)
         if low_field is None:
             return None
 
         # Read the high field of the serial number
-        high_field = self.read_value(0x55, address, group, is_float=False)
+        high_field = self.get_serial_number_high(address, group)
         if high_field is None:
             return None
 
@@ -202,12 +528,6 @@ class UXRChargerModule:
         serial_number = (high_field << 16) | low_field
         return serial_number
 
-    def get_dcdc_version(self, address, group):
-        return self.read_value(0x56, address, group, is_float=False)
-
-    def get_pfc_version(self, address, group):
-        return self.read_value(0x57, address, group, is_float=False)
-
     def get_alarm_status(self, address, group):
         """
         Reads and decodes the alarm/status register.
@@ -220,60 +540,182 @@ class UXRChargerModule:
             dict: A dictionary with the status bits and their descriptions.
         """
         # Read the alarm/status value from register 0x0040
-        status = self.read_value(0x40, address, group, is_float=False)
+        status = self.get_alarm_status_bits(address, group)
         
         if status is None:
             return None
 
-        # Decode the status bits based on Table-2
-        status_bits = {
-            0: "Module fault (red light)",
-            1: "Module protection (yellow light)",
-            2: "Reserved",
-            3: "Inside SCI communication error",
-            4: "Input mode detection error (or input wiring error)",
-            5: "Input mode mismatch",
-            6: "Reserved",
-            7: "DCDC overvoltage",
-            8: "PFC voltage exception (unbalanced, overvoltage, or undervoltage)",
-            9: "AC overvoltage",
-            10: "Reserved",
-            11: "Reserved",
-            12: "Reserved",
-            13: "Reserved",
-            14: "AC undervoltage",
-            15: "Reserved",
-            16: "CAN communication error",
-            17: "Unbalanced current",
-            18: "Reserved",
-            19: "Reserved",
-            20: "Reserved",
-            21: "Reserved",
-            22: "DCDC status of power (0: power on, 1: power off)",
-            23: "Module limit power",
-            24: "Temperature limit power",
-            25: "AC limit power",
-            26: "Reserved",
-            27: "Fans fault",
-            28: "DCDC short-circuit",
-            29: "Reserved",
-            30: "DCDC overtemperature",
-            31: "DCDC output overvoltage"
-        }
-
-        # Create a dictionary to store the active alarms
-        active_alarms = {}
-        for bit, description in status_bits.items():
-            if status & (1 << bit):
-                active_alarms[bit] = description
-
-        return active_alarms
+        return self.decode_alarm_status(status)
 
-    # More functions can be added for other registers
+    def shutdown(self):
+        """Stops the notifier thread and releases the bus."""
+        self.notifier.stop()
+        self.bus.shutdown()
 
     def __del__(self):
-        if self.bus:
-            self.bus.shutdown()
+        if getattr(self, 'notifier', None):
+            self.shutdown()
+
+def make_register_getter(entry):
+    def getter(self, address, group):
+        return from_raw(entry, self.read_value(entry.register, address, group, entry.is_float))
+    getter.__doc__ = f"Reads register 0x{entry.register:02X} ({entry.name})."
+    return getter
+
+
+def make_register_setter(entry):
+    def setter(self, value, address, group):
+        if not in_range(entry, value):
+            logging.warning(f"Ignoring out of range {entry.name} value {value}")
+            return
+        self.set_value(entry.register, to_raw(entry, value), address, group, entry.is_float)
+    setter.__doc__ = f"Writes register 0x{entry.register:02X} ({entry.name})."
+    return setter
+
+
+def make_group_setter(entry):
+    def setter(self, value, group):
+        if not in_range(entry, value):
+            logging.warning(f"Ignoring out of range {entry.name} value {value}")
+            return
+        self.set_group_value(entry.register, to_raw(entry, value), group, entry.is_float)
+    setter.__doc__ = f"Broadcasts register 0x{entry.register:02X} ({entry.name}) to a group."
+    return setter
+
+
+for entry in REGISTERS:
+    if entry.writable:
+        setattr(UXRChargerModule, f"set_{entry.name}", make_register_setter(entry))
+        setattr(UXRChargerModule, f"set_group_{entry.name}", make_group_setter(entry))
+    else:
+        setattr(UXRChargerModule, f"get_{entry.name}", make_register_getter(entry))
+UXRChargerModule.power_on_off = UXRChargerModule.set_power
+UXRChargerModule.group_power_on_off = UXRChargerModule.set_group_power
+
+
+class AsyncUXRChargerModule(UXRProtocol):
+    """
+    asyncio client for the UXR protocol.
+
+    Frames are received through python-can's AsyncBufferedReader and replies are
+    resolved as futures on the event loop, so one loop can drive many modules and
+    many buses concurrently, e.g. with asyncio.gather().
+
+    Usage:
+        async with AsyncUXRChargerModule(channel='/dev/ttyACM0') as module:
+            voltage = await module.read_value(0x01, address, group)
+    """
+
+    def __init__(self, channel, bitrate=125000, timeout=2, interface='slcan', can_filters=None, **bus_options):
+        self.bus = can.interface.Bus(channel=channel, interface=interface, bitrate=bitrate,
+                                     can_filters=can_filters, **bus_options)
+        self.timeout = timeout
+        self.reader = can.AsyncBufferedReader()
+        self.notifier = None
+        self.router_task = None
+        # (address, group, register) -> deque of futures, oldest first
+        self.waiting = {}
+
+    async def start(self):
+        """Starts receiving on the running event loop."""
+        loop = asyncio.get_running_loop()
+        self.notifier = can.Notifier(self.bus, [self.reader], timeout=0.1, loop=loop)
+        self.router_task = loop.create_task(self.route_replies())
+
+    async def close(self):
+        """Stops receiving and releases the bus."""
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None
+        if self.router_task is not None:
+            self.router_task.cancel()
+            try:
+                await self.router_task
+            except asyncio.CancelledError:
+                pass
+            self.router_task = None
+        self.bus.shutdown()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def route_replies(self):
+        async for message in self.reader:
+            key = self.reply_key(message)
+            waiting = self.waiting.get(key) if key is not None else None
+            if not waiting:
+                logging.debug(f"Discarding unsolicited frame 0x{message.arbitration_id:08X}")
+                continue
+            future = waiting.popleft()
+            if not waiting:
+                del self.waiting[key]
+            if not future.done():
+                future.set_result(bytes(message.data))
+
+    def send_frame(self, arbitration_id, data):
+        frame = can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=True)
+        self.bus.send(frame)
+
+    def cancel(self, key, future):
+        """Stops waiting for a read so a reply for the same key goes to the next read."""
+        waiting = self.waiting.get(key)
+        if waiting and future in waiting:
+            waiting.remove(future)
+            if not waiting:
+                del self.waiting[key]
+
+    async def read_value(self, register, address, group, is_float=True, timeout=None):
+        """
+        Reads a register, returning the decoded value or None on timeout or type mismatch.
+
+        Parameters:
+            timeout (float): Seconds to wait for the reply; defaults to the client timeout.
+        """
+        if self.router_task is None:
+            await self.start()
+        key = (address, group, register)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(key, deque()).append(future)
+        arbitration_id = self.generate_can_arbitration_id(self.protno, 1, address, self.source_address, group)
+        try:
+            self.send_frame(arbitration_id, self.read_request(register))
+        except can.CanError:
+            # Nothing was sent, so no reply will ever complete the read
+            self.cancel(key, future)
+            raise
+        try:
+            response_data = await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.cancel(key, future)
+            return None
+        return self.parse_response(response_data, is_float)
+
+    async def set_value(self, register, value, address, group, is_float=True):
+        """Sets a value on the device for the given register, see UXRChargerModule.set_value()."""
+        arbitration_id = self.generate_can_arbitration_id(self.protno, 1, address, self.source_address, group)
+        self.send_frame(arbitration_id, self.write_request(register, value, is_float))
+
+    async def get_serial_number(self, address, group):
+        """Reads the low and high serial number fields concurrently and combines them."""
+        low_field, high_field = await asyncio.gather(
+            self.read_value(0x54, address, group, is_float=False),
+            self.read_value(0x55, address, group, is_float=False),
+        )
+        if low_field is None or high_field is None:
+            return None
+        return (high_field << 16) | low_field
+
+    async def get_alarm_status(self, address, group):
+        """Reads and decodes the alarm/status register, see UXRChargerModule.get_alarm_status()."""
+        status = await self.read_value(0x40, address, group, is_float=False)
+        if status is None:
+            return None
+        return self.decode_alarm_status(status)
+
 
 if __name__ == "__main__":
     module = UXRChargerModule(channel='/dev/ttyACM0')
@@ -0,0 +1,241 @@
+"""
+Software simulator for a rack of UXR charger modules.
+
+Emulates any number of modules on a python-can bus (the in-process 'virtual'
+interface by default), answering 0x10 reads with 0x41/0x42 replies and applying
+0x03 writes, both point-to-point and group broadcast. Reply latency, jitter and
+drop rate are configurable so polling and throughput can be exercised without
+hardware.
+
+Usage:
+    with UXRSimulator(count=20, latency=0.002) as simulator:
+        module = UXRChargerModule(channel=simulator.channel, interface='virtual')
+        print(module.get_module_voltage(0, 0))
+"""
+import struct
+import time
+import heapq
+import random
+import itertools
+import threading
+import logging
+import argparse
+import can
+from registers import REGISTERS
+
+REGISTER_TYPES = {entry.register: entry.is_float for entry in REGISTERS}
+
+# Power state values written to register 0x30
+POWER_ON = 0x00000000
+POWER_OFF = 0x00010000
+
+
+class SimulatedModule:
+    """Register state of one emulated UXR module."""
+
+    def __init__(self, address, group, serial_number, rated_current=40.0, rated_power=30000.0):
+        self.address = address
+        self.group = group
+        self.serial_number = serial_number
+        # Replaced by the simulator's own generator, so its seed makes readings reproducible
+        self.random = random.Random()
+        self.values = {
+            0x01: 775.0,                    # Module voltage
+            0x02: 10.0,                     # Module current
+            0x03: 0.5,                      # Current limit, fraction of rated current
+            0x04: 35.0,                     # DC board temperature
+            0x05: 230.0,                    # Input phase voltage
+            0x08: 400.0,                    # PFC0 voltage
+            0x0A: 400.0,                    # PFC1 voltage
+            0x0B: 30.0,                     # Panel board temperature
+            0x0C: 230.0,                    # Phase A voltage
+            0x0D: 230.0,                    # Phase B voltage
+            0x0E: 230.0,                    # Phase C voltage
+            0x10: 40.0,                     # PFC board temperature
+            0x11: rated_power,
+            0x12: rated_current,
+            0x40: 0,                        # Alarm status
+            0x48: 7750,                     # Input power
+            0x4A: 1000,                     # Altitude
+            0x4B: 1,                        # Input working mode
+            0x54: serial_number & 0xFFFF,
+            0x55: serial_number >> 16,
+            0x56: 0x0102,                   # DCDC version
+            0x57: 0x0103,                   # PFC version
+        }
+
+    def read(self, register):
+        """Returns the current value of a register, or None if the module does not have it."""
+        self.values[0x02] = round(self.values[0x03] * self.values[0x12] * self.random.uniform(0.9, 1.0), 2) \
+            if self.values.get(0x30, POWER_ON) == POWER_ON else 0.0
+        self.values[0x48] = int(self.values[0x01] * self.values[0x02])
+        return self.values.get(register)
+
+    def write(self, register, value):
+        """Applies a write, mirroring set-points into the registers that read them back."""
+        self.values[register] = value
+        if register == 0x21:
+            self.values[0x01] = value
+        elif register == 0x22:
+            self.values[0x03] = value
+        elif register == 0x17:
+            self.values[0x4A] = value
+
+
+class UXRSimulator:
+    """
+    Emulates a rack of UXR modules on a CAN bus.
+
+    Parameters:
+        channel (str): Bus channel to attach to.
+        count (int): Number of modules, addressed 0..count-1 in `group`; ignored if `modules` is given.
+        modules (list): SimulatedModule instances to emulate instead of `count` defaults.
+        latency (float): Seconds between a request and its reply.
+        jitter (float): Maximum random deviation added to the latency, in seconds.
+        drop_rate (float): Probability of a request going unanswered.
+        interface (str): python-can interface; 'virtual' for in-process use, 'socketcan' for vcan.
+        seed: Seed for the latency jitter, dropped replies and simulated current, for reproducible runs.
+    """
+
+    def __init__(self, channel='uxr-sim', count=1, group=0, modules=None, latency=0.0, jitter=0.0,
+                 drop_rate=0.0, interface='virtual', seed=None, serial_base=10000):
+        self.channel = channel
+        self.interface = interface
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        if modules is None:
+            modules = [SimulatedModule(address, group, serial_base + address) for address in range(count)]
+        self.modules = {(sim.address, sim.group): sim for sim in modules}
+        for sim in modules:
+            sim.random = self.random
+        self.bus = None
+        self.notifier = None
+        # Replies waiting for their send time: (send at, sequence, message)
+        self.outbox = []
+        self.outbox_ready = threading.Condition()
+        self.counter = itertools.count()
+        self.running = False
+        self.sender = None
+        self.frames_received = 0
+        self.replies_sent = 0
+        self.dropped = 0
+
+    def config_modules(self):
+        """Returns the emulated modules in the format of the app's `modules` option."""
+        return [{'SERIAL_NR': str(sim.serial_number), 'HA_PREFIX': 'SIM', 'CANBUS_ID': sim.address, 'GROUP_ID': sim.group}
+                for sim in self.modules.values()]
+
+    def start(self):
+        self.bus = can.interface.Bus(channel=self.channel, interface=self.interface)
+        self.running = True
+        self.sender = threading.Thread(target=self.send_loop, name="uxr-sim-sender", daemon=True)
+        self.sender.start()
+        self.notifier = can.Notifier(self.bus, [self.on_message], timeout=0.1)
+        return self
+
+    def stop(self):
+        if self.notifier is not None:
+            self.notifier.stop()
+        with self.outbox_ready:
+            self.running = False
+            self.outbox_ready.notify()
+        if self.sender is not None:
+            self.sender.join(timeout=1)
+        if self.bus is not None:
+            self.bus.shutdown()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def on_message(self, msg):
+        arbitration_id = msg.arbitration_id
+        if not msg.is_extended_id or len(msg.data) < 8 or (arbitration_id >> 20) & 0x1FF != 0x060:
+            return
+        self.frames_received += 1
+        ptp = (arbitration_id >> 19) & 0x1
+        dstaddr = (arbitration_id >> 11) & 0xFF
+        srcaddr = (arbitration_id >> 3) & 0xFF
+        group = arbitration_id & 0x7
+        if ptp:
+            sim = self.modules.get((dstaddr, group))
+            targets = [sim] if sim is not None else []
+        else:
+            targets = [sim for sim in self.modules.values() if sim.group == group]
+        command, register = msg.data[0], msg.data[3]
+        for sim in targets:
+            if command == 0x03:
+                if REGISTER_TYPES.get(register, True):
+                    sim.write(register, struct.unpack('>f', bytes(msg.data[4:8]))[0])
+                else:
+                    sim.write(register, struct.unpack('>I', bytes(msg.data[4:8]))[0])
+            elif command == 0x10 and ptp:
+                self.reply(sim, srcaddr, register)
+
+    def reply(self, sim, dstaddr, register):
+        value = sim.read(register)
+        if value is None:
+            return
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        if REGISTER_TYPES.get(register, True):
+            data = [0x41, 0x00, 0x00, register] + list(struct.pack('>f', value))
+        else:
+            data = [0x42, 0x00, 0x00, register] + list(struct.pack('>I', int(value)))
+        arbitration_id = (0x060 << 20) | (1 << 19) | (dstaddr << 11) | (sim.address << 3) | sim.group
+        message = can.Message(arbitration_id=arbitration_id, data=data, is_extended_id=True)
+        delay = max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+        if delay == 0:
+            self.send(message)
+            return
+        with self.outbox_ready:
+            heapq.heappush(self.outbox, (time.monotonic() + delay, next(self.counter), message))
+            self.outbox_ready.notify()
+
+    def send(self, message):
+        try:
+            self.bus.send(message)
+            self.replies_sent += 1
+        except can.CanError as e:
+            logging.error(f"Simulator send failed: {e}")
+
+    def send_loop(self):
+        while True:
+            with self.outbox_ready:
+                while self.running and (not self.outbox or self.outbox[0][0] > time.monotonic()):
+                    timeout = self.outbox[0][0] - time.monotonic() if self.outbox else None
+                    self.outbox_ready.wait(timeout)
+                if not self.running:
+                    return
+                _, _, message = heapq.heappop(self.outbox)
+            self.send(message)
+
+
+if __name__ == "__main__":
+    # Serve a simulated rack on a SocketCAN interface (e.g. vcan0) for out-of-process testing
+    parser = argparse.ArgumentParser(description="Simulate UXR charger modules on a CAN bus")
+    parser.add_argument('--channel', default='vcan0')
+    parser.add_argument('--interface', default='socketcan')
+    parser.add_argument('--count', type=int, default=4)
+    parser.add_argument('--group', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    with UXRSimulator(channel=args.channel, interface=args.interface, count=args.count, group=args.group,
+                      latency=args.latency, jitter=args.jitter, drop_rate=args.drop_rate) as simulator:
+        for entry in simulator.config_modules():
+            logging.info(f"Simulating module {entry}")
+        try:
+            while True:
+                time.sleep(10)
+                logging.info(f"Received {simulator.frames_received} frames, sent {simulator.replies_sent} replies, dropped {simulator.dropped}")
+        except KeyboardInterrupt:
+            pass